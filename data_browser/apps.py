@@ -0,0 +1,25 @@
+from django.apps import AppConfig
+
+from .common import debug_log, settings
+
+
+class DataBrowserConfig(AppConfig):
+    name = "data_browser"
+    verbose_name = "Data Browser"
+
+    def ready(self):
+        from django.db.models.signals import m2m_changed, post_delete, post_save
+
+        from .orm_admin import load_schema_snapshot
+        from .orm_results import bump_model_version
+
+        post_save.connect(bump_model_version, dispatch_uid=__name__)
+        post_delete.connect(bump_model_version, dispatch_uid=__name__)
+        m2m_changed.connect(bump_model_version, dispatch_uid=__name__)
+
+        path = settings.DATA_BROWSER_SCHEMA_SNAPSHOT
+        if path and not load_schema_snapshot(path):
+            # ready runs in every process so it's left to ddb_schema_snapshot to
+            # write it, loading it before forking (e.g. gunicorn --preload) lets
+            # the workers share it copy on write
+            debug_log(f"No usable schema snapshot at {path}, run ddb_schema_snapshot")
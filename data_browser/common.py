@@ -1,5 +1,7 @@
 import logging
 import math
+import threading
+from collections import OrderedDict
 
 from django import http
 
@@ -12,8 +14,8 @@ def can_make_public(user):
     return user.has_perm(f"data_browser.{MAKE_PUBLIC_CODENAME}")
 
 
-def JsonResponse(data):
-    res = http.JsonResponse(data, safe=False)
+def JsonResponse(data, status=200):
+    res = http.JsonResponse(data, safe=False, status=status)
     res["X-Version"] = version
     res["Access-Control-Expose-Headers"] = "X-Version"
     return res
@@ -26,6 +28,13 @@ def HttpResponse(*args, **kwargs):
     return res
 
 
+def StreamingHttpResponse(*args, **kwargs):
+    res = http.StreamingHttpResponse(*args, **kwargs)
+    res["X-Version"] = version
+    res["Access-Control-Expose-Headers"] = "X-Version"
+    return res
+
+
 def debug_log(msg):  # pragma: no cover
     if settings.DEBUG:
         logging.getLogger(__name__).warning(f"DDB: {msg}")
@@ -42,32 +51,128 @@ def all_subclasses(cls):
     return res
 
 
-def get_optimal_decimal_places(nums, sf=3, max_dp=6):
-    actual_dps = set()
-    filtered = set()
-    for num in nums:
-        if num:
-            s = f"{num:g}"
-            filtered.add(num)
-            if "e-" in s:
-                actual_dps.add(float("inf"))
-            elif "." in s:
-                actual_dps.add(len(s.split(".")[1]))
-            else:
-                actual_dps.add(0)
-
-    if not filtered:
+def _decimal_places(num):
+    # how many decimal places f"{num:g}" shows, without formatting the common cases
+    if -1e4 < num < 1e4:
+        hundredths = num * 100
+        if hundredths == int(hundredths):
+            hundredths = int(hundredths)
+            return 0 if not hundredths % 100 else 1 if not hundredths % 10 else 2
+
+    s = f"{num:g}"
+    if "e-" in s:
+        return float("inf")
+    elif "." in s:
+        return len(s.split(".")[1])
+    else:
         return 0
 
-    max_actual_dp = max(actual_dps)
-    if max_actual_dp <= 2:
-        return max_actual_dp
 
-    min_value = min(filtered)
-    min_magnitude = math.floor(math.log(min_value, 10))
-    dp_for_sf = sf - min_magnitude - 1
+class OptimalDecimalPlaces:
+    """get_optimal_decimal_places built up a batch of numbers at a time."""
+
+    def __init__(self, sf=3, max_dp=6):
+        self.sf = sf
+        self.max_dp = max_dp
+        self.max_actual_dp = 0
+        self.min_value = None
+
+    def add(self, nums):
+        nums = [num for num in nums if num]
+        if not nums:
+            return
+
+        min_value = min(nums)
+        if self.min_value is None or min_value < self.min_value:
+            self.min_value = min_value
+
+        # past max_dp the answer only depends on the smallest number
+        enough = max(self.max_dp, 3)
+        max_actual_dp = self.max_actual_dp
+        for num in nums:
+            if max_actual_dp >= enough:
+                break
+            dp = _decimal_places(num)
+            if dp > max_actual_dp:
+                max_actual_dp = dp
+        self.max_actual_dp = max_actual_dp
+
+    @property
+    def value(self):
+        if self.min_value is None:
+            return 0
+
+        if self.max_actual_dp <= 2:
+            return self.max_actual_dp
+
+        min_magnitude = math.floor(math.log(self.min_value, 10))
+        dp_for_sf = self.sf - min_magnitude - 1
+
+        return max(0, min(dp_for_sf, self.max_actual_dp, self.max_dp))
+
+
+def get_optimal_decimal_places(nums, sf=3, max_dp=6):
+    res = OptimalDecimalPlaces(sf, max_dp)
+    res.add(nums)
+    return res.value
+
+
+class LRUCache:
+    """A thread safe in-process LRU with hit / miss counters.
+
+    The size comes from the named setting on every write so it can be changed (or
+    set to zero to disable the cache) without restarting.
+    """
+
+    def __init__(self, size_setting):
+        self.size_setting = size_setting
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def maxsize(self):
+        return getattr(settings, self.size_setting)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        maxsize = self.maxsize
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > max(0, maxsize):
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+
+
+def get_shared_cache():
+    alias = settings.DATA_BROWSER_SHARED_CACHE_ALIAS
+    if alias is None:
+        return None
+
+    from django.core.cache import caches
 
-    return max(0, min(dp_for_sf, max_actual_dp, max_dp))
+    return caches[alias]
 
 
 class Settings:
@@ -77,6 +182,22 @@ class Settings:
         "DATA_BROWSER_DEFAULT_ROW_LIMIT": 1000,
         "DATA_BROWSER_DEV": False,
         "DATA_BROWSER_FE_DSN": None,
+        "DATA_BROWSER_CUSTOM_MODEL_VISIBLE_METHOD": None,
+        "DATA_BROWSER_SCHEMA_CACHE_SIZE": 0,
+        "DATA_BROWSER_LAZY_MODEL_FIELDS": False,
+        "DATA_BROWSER_MAX_INLINE_CHOICES": None,
+        "DATA_BROWSER_SCHEMA_SNAPSHOT": None,
+        "DATA_BROWSER_SHARED_CACHE_ALIAS": None,
+        "DATA_BROWSER_QUERY_CACHE_SIZE": 0,
+        "DATA_BROWSER_SQL_CACHE_SIZE": 0,
+        "DATA_BROWSER_PIVOT_WORKERS": 0,
+        "DATA_BROWSER_CHUNK_SIZE": 2000,
+        "DATA_BROWSER_STREAM_ROW_LIMIT": 10000,
+        "DATA_BROWSER_CALCULATED_CACHE_ALIAS": "default",
+        "DATA_BROWSER_RESULTS_CACHE_TIMEOUT": 0,
+        "DATA_BROWSER_RESULTS_CACHE_NOW_BUCKET": 60,
+        "DATA_BROWSER_ESTIMATE_COUNTS": False,
+        "DATA_BROWSER_QUERY_TIMEOUT": None,
     }
 
     def __getattr__(self, name):
@@ -1,3 +1,6 @@
+import copy
+import functools
+
 from django.db.models import BooleanField
 from django.urls import reverse
 
@@ -28,20 +31,7 @@ class AdminMixin:
                 continue
 
             qs = descriptor.get_queryset(self, request, qs)
-
-            annotation = qs.query.annotations.get(descriptor.name)
-            if not annotation:  # pragma: no cover
-                raise Exception(
-                    f"Can't find annotation '{descriptor.name}' for {self}.{descriptor.name}"
-                )
-
-            field_type = getattr(annotation, "output_field", None)
-            if not field_type:  # pragma: no cover
-                raise Exception(
-                    f"Annotation '{descriptor.name}' for {self}.{descriptor.name} doesn't specify 'output_field'"
-                )
-
-            descriptor.boolean = isinstance(field_type, BooleanField)
+            descriptor.resolve_output_field(self, qs)
         return qs
 
     def get_readonly_fields(self, request, obj=None):
@@ -68,6 +58,8 @@ class AdminMixin:
 class AnnotationDescriptor:
     def __init__(self, get_queryset):
         self.get_queryset = get_queryset
+        self._output_fields = {}  # admin class -> output field
+        self._admin = None
 
     def __set_name__(self, owner, name):
         self.name = name
@@ -80,15 +72,63 @@ class AnnotationDescriptor:
         owner._ddb_annotations()[name] = self
 
     def __get__(self, instance, owner=None):
-        return self
+        if instance is None:
+            return self
+        # the output field can differ between admins sharing this descriptor
+        bound = copy.copy(self)
+        bound._admin = instance
+        return bound
 
     def __call__(self, obj):
         return getattr(obj, self.name)
 
+    @property
+    def boolean(self):
+        # read by the admin changelist to decide whether to render icons
+        field = self._output_fields.get(type(self._admin))
+        return isinstance(field, BooleanField)
+
+    def resolve_output_field(self, admin, qs):
+        key = type(admin)
+        if key not in self._output_fields:
+            annotation = qs.query.annotations.get(self.name)
+            if not annotation:  # pragma: no cover
+                raise Exception(
+                    f"Can't find annotation '{self.name}' for {admin}.{self.name}"
+                )
+
+            field_type = getattr(annotation, "output_field", None)
+            if not field_type:  # pragma: no cover
+                raise Exception(
+                    f"Annotation '{self.name}' for {admin}.{self.name} doesn't specify 'output_field'"
+                )
+
+            self._output_fields[key] = field_type
+        return self._output_fields[key]
+
+    def get_output_field(self, admin, request):
+        if type(admin) not in self._output_fields:
+            from .orm_admin import admin_get_queryset
+
+            qs = admin_get_queryset(admin, request, [self.name])
+            self.resolve_output_field(admin, qs)
+        return self._output_fields[type(admin)]
+
 
 def ddb_hide(func):
     func.ddb_hide = True
     return func
 
 
+def ddb_batch(func):
+    # func(self, objs) returns {pk: value} for the whole list of objs, calling the
+    # decorated method with a single obj still works for the admin changelist
+    @functools.wraps(func)
+    def wrapper(self, obj):
+        return func(self, [obj]).get(obj.pk)
+
+    wrapper.ddb_batch = func
+    return wrapper
+
+
 annotation = AnnotationDescriptor
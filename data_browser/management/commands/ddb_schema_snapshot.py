@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from data_browser.common import settings
+from data_browser.orm_admin import write_schema_snapshot
+
+
+class Command(BaseCommand):
+    help = "Precompute the static part of the Data Browser schema into a snapshot file."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            nargs="?",
+            default=None,
+            help="Where to write the snapshot, defaults to DATA_BROWSER_SCHEMA_SNAPSHOT.",
+        )
+
+    def handle(self, *args, path=None, **options):
+        path = path or settings.DATA_BROWSER_SCHEMA_SNAPSHOT
+        if not path:
+            raise CommandError("No path given and DATA_BROWSER_SCHEMA_SNAPSHOT not set")
+
+        snapshot = write_schema_snapshot(path)
+        self.stdout.write(
+            f"Wrote schema snapshot for {len(snapshot['models'])} models to {path}"
+        )
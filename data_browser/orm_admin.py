@@ -1,14 +1,29 @@
+import hashlib
+import json
+import os
+import pickle
+import pkgutil
+import tempfile
 from collections import defaultdict
-
+from collections.abc import Mapping
+from dataclasses import dataclass
+from functools import lru_cache
+from importlib import import_module
+from types import MappingProxyType
+from typing import Any, Sequence
+
+from django.apps import apps
 from django.contrib.admin import site
 from django.contrib.admin.options import InlineModelAdmin
 from django.contrib.admin.utils import flatten_fieldsets
 from django.contrib.auth.admin import UserAdmin
 from django.db import models
+from django.db.migrations.loader import MigrationLoader
 from django.db.models.fields.reverse_related import ForeignObjectRel, OneToOneRel
 from django.forms.models import _get_foreign_key
 
-from .common import debug_log, settings
+from . import version
+from .common import LRUCache, debug_log, get_shared_cache, settings
 from .helpers import AdminMixin, AnnotationDescriptor
 from .orm_fields import (
     OPEN_IN_ADMIN,
@@ -74,115 +89,178 @@ _FIELD_TYPE_MAP = {
     **{f: NumberType for f in _NUMBER_FIELDS},
 }
 
+# the type models only depend on the type registry so they are built once on
+# import and shared by every request (and every worker forked after import)
+_TYPE_ORM_MODELS = MappingProxyType(
+    {
+        type_.name: OrmModel(MappingProxyType(get_fields_for_type(type_)))
+        for type_ in TYPES.values()
+    }
+)
+
 
 def admin_get_queryset(admin, request, fields=()):
     request.data_browser = {"calculated_fields": set(fields), "fields": set(fields)}
     return admin.get_queryset(request)
 
 
-def _get_all_admin_fields(request):
-    request.data_browser = {"calculated_fields": set(), "fields": set()}
+def _from_fieldsets(request, admin, all_):
+    auth_user_compat = settings.DATA_BROWSER_AUTH_USER_COMPAT
+    if auth_user_compat and isinstance(admin, UserAdmin):
+        obj = admin.model()  # get the change fieldsets, not the add ones
+    else:
+        obj = None
 
-    def from_fieldsets(admin, all_):
-        auth_user_compat = settings.DATA_BROWSER_AUTH_USER_COMPAT
-        if auth_user_compat and isinstance(admin, UserAdmin):
-            obj = admin.model()  # get the change fieldsets, not the add ones
-        else:
-            obj = None
+    fields = admin.get_fieldsets(request, obj)
+    for f in flatten_fieldsets(fields):
+        # skip calculated fields on inlines
+        if not isinstance(admin, InlineModelAdmin) or hasattr(admin.model, f):
+            yield f
 
-        fields = admin.get_fieldsets(request, obj)
-        for f in flatten_fieldsets(fields):
-            # skip calculated fields on inlines
-            if not isinstance(admin, InlineModelAdmin) or hasattr(admin.model, f):
-                yield f
 
-    def visible(model_admin, request):
-        attrs = ["get_fieldsets", "model", "get_queryset"]
-        if not all(hasattr(model_admin, a) for a in attrs):
-            debug_log(
-                f"{type(model_admin)} instance does not look like a ModelAdmin or InlineModelAdmin"
+def _visible(model_admin, request):
+    attrs = ["get_fieldsets", "model", "get_queryset"]
+    if not all(hasattr(model_admin, a) for a in attrs):
+        debug_log(
+            f"{type(model_admin)} instance does not look like a ModelAdmin or InlineModelAdmin"
+        )
+        return False
+    if getattr(model_admin, "ddb_ignore", False):
+        return False
+    if model_admin.has_change_permission(request):
+        return True
+    if hasattr(model_admin, "has_view_permission"):
+        return model_admin.has_view_permission(request)
+    else:
+        return False  # pragma: no cover  Django < 2.1
+
+
+class _AdminFields:
+    """Maps the visible models to the names of the fields their admins show.
+
+    A model's fields come from its own admin and any inlines of it on other
+    admins. Each model is worked out on first access so a query only asks the
+    admins of the models it reaches, rather than every registered admin.
+    """
+
+    def __init__(self, request):
+        self._request = request
+        self._fields = {}
+        self._admins = {}
+        self._visibility = {}
+        self._inlines = {}
+
+        # which admins could have each model as an inline, the instances depend
+        # on the request and are only asked for when one of the models is needed
+        self._inline_parents = defaultdict(list)
+        self._candidates = {}  # abuse dict as an ordered set
+        for model, model_admin in site._registry.items():
+            self._candidates[model] = None
+            for inline in getattr(model_admin, "inlines", ()):
+                self._inline_parents[inline.model].append(model)
+                self._candidates[inline.model] = None
+
+    def candidates(self):
+        """The models that might be visible, without asking their admins."""
+        return list(self._candidates)
+
+    def admin(self, model):
+        """The admin of a visible model, its own if it's registered."""
+        self[model]
+        return self._admins[model]
+
+    def freeze(self):
+        """Work out every model and drop the request."""
+        for model in self._candidates:
+            self._get(model)
+        self._request = None
+        return self
+
+    def __getitem__(self, model):
+        fields = self._get(model)
+        if fields is None:
+            raise KeyError(model)
+        return fields
+
+    def __contains__(self, model):
+        return self._get(model) is not None
+
+    def _is_visible(self, model_admin):
+        # todo: monkey patching
+        method_visible = settings.DATA_BROWSER_CUSTOM_MODEL_VISIBLE_METHOD or _visible
+        if model_admin not in self._visibility:
+            self._visibility[model_admin] = method_visible(model_admin, self._request)
+        return self._visibility[model_admin]
+
+    def _get_inlines(self, model):
+        # the visible inlines of the admin for model, if it's visible itself
+        if model not in self._inlines:
+            model_admin = site._registry[model]
+            self._inlines[model] = []
+            if self._is_visible(model_admin):
+                # these are already filtered for access
+                for inline in model_admin.get_inline_instances(self._request):
+                    if self._is_visible(inline):
+                        self._inlines[model].append(inline)
+        return self._inlines[model]
+
+    def _get(self, model):
+        if model not in self._fields:
+            self._fields[model] = (
+                self._get_fields(model) if model in self._candidates else None
             )
-            return False
-        if getattr(model_admin, "ddb_ignore", False):
-            return False
-        if model_admin.has_change_permission(request):
-            return True
-        if hasattr(model_admin, "has_view_permission"):
-            return model_admin.has_view_permission(request)
-        else:
-            return False  # pragma: no cover  Django < 2.1
-
-    # todo: monkey patching
-    method_visible = visible
-    if settings.DATA_BROWSER_CUSTOM_MODEL_VISIBLE_METHOD:
-        method_visible = settings.DATA_BROWSER_CUSTOM_MODEL_VISIBLE_METHOD
-
-    all_admin_fields = defaultdict(set)
-    hidden_fields = defaultdict(set)
-    model_admins = {}
-    for model, model_admin in site._registry.items():
-        model_admins[model] = model_admin
-        if method_visible(model_admin, request):
-            all_admin_fields[model].update(from_fieldsets(model_admin, True))
-            all_admin_fields[model].update(model_admin.get_list_display(request))
-            all_admin_fields[model].update(getattr(model_admin, "ddb_extra_fields", []))
-            all_admin_fields[model].add(OPEN_IN_ADMIN)
+        return self._fields[model]
+
+    def _get_fields(self, model):
+        request = self._request
+        request.data_browser = {"calculated_fields": set(), "fields": set()}
+        fields = set()
+        hidden_fields = set()
+
+        model_admin = site._registry.get(model)
+        if model_admin is not None and self._is_visible(model_admin):
+            fields.update(_from_fieldsets(request, model_admin, True))
+            fields.update(model_admin.get_list_display(request))
+            fields.update(getattr(model_admin, "ddb_extra_fields", []))
+            fields.add(OPEN_IN_ADMIN)
             if isinstance(model_admin, AdminMixin):
-                all_admin_fields[model].update(model_admin._ddb_annotations())
-            hidden_fields[model].update(getattr(model_admin, "ddb_hide_fields", []))
-
-            # check the inlines, these are already filtered for access
-            for inline in model_admin.get_inline_instances(request):
-                if method_visible(inline, request):
-                    try:
-                        fk_field = _get_foreign_key(model, inline.model, inline.fk_name)
-                    except Exception as e:
-                        debug_log(e)  # ignore things like GenericInlineModelAdmin
-                    else:
-                        if inline.model not in model_admins:  # pragma: no branch
-                            model_admins[inline.model] = inline
-                        all_admin_fields[inline.model].update(
-                            from_fieldsets(inline, False)
-                        )
-                        all_admin_fields[inline.model].update(
-                            getattr(inline, "ddb_extra_fields", [])
-                        )
-                        all_admin_fields[inline.model].add(fk_field.name)
-                        hidden_fields[inline.model].update(
-                            getattr(inline, "ddb_hide_fields", [])
-                        )
-
-    # we always have id and never pk
-    for fields in all_admin_fields.values():
+                fields.update(model_admin._ddb_annotations())
+            hidden_fields.update(getattr(model_admin, "ddb_hide_fields", []))
+
+        for parent in self._inline_parents.get(model, []):
+            for inline in self._get_inlines(parent):
+                if inline.model is not model:
+                    continue
+                try:
+                    fk_field = _get_foreign_key(parent, inline.model, inline.fk_name)
+                except Exception as e:
+                    debug_log(e)  # ignore things like GenericInlineModelAdmin
+                else:
+                    if model_admin is None:
+                        model_admin = inline
+                    fields.update(_from_fieldsets(request, inline, False))
+                    fields.update(getattr(inline, "ddb_extra_fields", []))
+                    fields.add(fk_field.name)
+                    hidden_fields.update(getattr(inline, "ddb_hide_fields", []))
+
+        if not fields:
+            return None
+        self._admins[model] = model_admin
+
+        # we always have id and never pk
         fields.add("id")
         fields.discard("pk")
         fields.discard("__str__")
 
-    # throw away the hidden ones
-    for model, fields in hidden_fields.items():
-        for f in fields:
-            all_admin_fields[model].discard(f)
-
-    return model_admins, all_admin_fields
+        # throw away the hidden ones
+        return fields - hidden_fields
 
 
-def _get_calculated_field(request, field_name, model_name, model, admin, model_fields):
+def _get_calculated_field(request, field_name, model_name, model, admin):
     field_func = getattr(admin, field_name, None)
     if isinstance(field_func, AnnotationDescriptor):
         admin_order_field = field_func.admin_order_field
-        qs = admin_get_queryset(admin, request, [field_name])
-
-        annotation = qs.query.annotations.get(admin_order_field)
-        if not annotation:  # pragma: no cover
-            raise Exception(
-                f"Can't find annotation '{admin_order_field}' for {admin}.{field_name}"
-            )
-
-        field_type = getattr(annotation, "output_field", None)
-        if not field_type:  # pragma: no cover
-            raise Exception(
-                f"Annotation '{admin_order_field}' for {admin}.{field_name} doesn't specify 'output_field'"
-            )
+        field_type = field_func.get_output_field(admin, request)
 
         type_, choices = _get_field_type(model, admin_order_field, field_type)
         if type_:  # pragma: no branch
@@ -194,7 +272,7 @@ def _get_calculated_field(request, field_name, model_name, model, admin, model_f
                 field_type=field_type,
                 admin=admin,
                 admin_order_field=admin_order_field,
-                choices=choices,
+                choices=_fmt_choices(choices),
             )
     else:
         if not getattr(getattr(admin, field_name, None), "ddb_hide", False):
@@ -209,28 +287,35 @@ def _get_calculated_field(request, field_name, model_name, model, admin, model_f
 
 
 def _fmt_choices(choices):
+    if not choices:
+        return None
     return [(value, str(label)) for value, label in choices]
 
 
+@lru_cache(maxsize=None)
+def _get_type_for_field_class(field_class):
+    if field_class in _FIELD_TYPE_MAP:
+        return _FIELD_TYPE_MAP[field_class]
+    for django_type, field_type in _FIELD_TYPE_MAP.items():
+        if issubclass(field_class, django_type):
+            return field_type
+    return None
+
+
 def _get_field_type(model, field_name, field):
     if isinstance(field, ArrayField) and isinstance(
         field.base_field, _STRING_FIELDS
     ):  # pragma: postgres
-        return StringArrayType, _fmt_choices(field.base_field.choices)
+        return StringArrayType, field.base_field.choices
     elif isinstance(field, ArrayField) and isinstance(
         field.base_field, _NUMBER_FIELDS
     ):  # pragma: postgres
-        return NumberArrayType, _fmt_choices(field.base_field.choices)
+        return NumberArrayType, field.base_field.choices
     elif isinstance(field, JSONField):
         res = JSONType
-    elif field.__class__ in _FIELD_TYPE_MAP:
-        res = _FIELD_TYPE_MAP[field.__class__]
     else:
-        for django_type, field_type in _FIELD_TYPE_MAP.items():
-            if isinstance(field, django_type):
-                res = field_type
-                break
-        else:
+        res = _get_type_for_field_class(field.__class__)
+        if res is None:
             debug_log(
                 f"{model.__name__}.{field_name} unsupported type {type(field).__name__}"
             )
@@ -238,9 +323,9 @@ def _get_field_type(model, field_name, field):
 
     # Choice fields have different lookups
     if res is StringType and field.choices:
-        return StringChoiceType, _fmt_choices(field.choices)
+        return StringChoiceType, field.choices
     elif res is NumberType and field.choices:
-        return NumberChoiceType, _fmt_choices(field.choices)
+        return NumberChoiceType, field.choices
     else:
         return res, None
 
@@ -248,7 +333,7 @@ def _get_field_type(model, field_name, field):
 def _make_json_sub_module(model_name, field_types):
     TYPE_MAP = {"string": StringType, "number": NumberType, "boolean": BooleanType}
 
-    fields = dict(get_fields_for_type(JSONType))
+    fields = dict(_TYPE_ORM_MODELS[JSONType.name].fields)
     for field_name, type_name in field_types.items():
         type_ = TYPE_MAP[type_name]
         fields[field_name] = OrmConcreteField(
@@ -262,43 +347,175 @@ def _make_json_sub_module(model_name, field_types):
     return OrmModel(fields)
 
 
+@dataclass(frozen=True)
+class _StaticField:
+    kind: str  # fk, file, concrete or skip
+    pretty_name: Any
+    type_: Any = None
+    choices: Sequence = None
+    related_model: Any = None
+
+
+def _get_static_field(model, field):
+    pretty_name = getattr(field, "verbose_name", None) or field.name
+    if isinstance(field, (models.ForeignKey, OneToOneRel)):
+        return _StaticField("fk", pretty_name, related_model=field.related_model)
+    elif isinstance(field, (ForeignObjectRel, models.ManyToManyField)):
+        return _StaticField("skip", pretty_name)  # TODO 2many support
+    elif isinstance(field, models.FileField):
+        return _StaticField("file", pretty_name)
+    else:
+        type_, choices = _get_field_type(model, field.name, field)
+        return _StaticField("concrete", pretty_name, type_, choices)
+
+
+_static_schema = {}
+
+
+def _get_static_fields(model):
+    """The part of a models schema that only depends on code, not the request.
+
+    Either loaded from the schema snapshot or worked out on first use.
+    """
+    model_name = get_model_name(model)
+    static_fields = _static_schema.get(model_name)
+    if static_fields is None:
+        static_fields = {
+            field.name: _get_static_field(model, field)
+            for field in model._meta.get_fields()
+        }
+        _static_schema[model_name] = static_fields
+    return static_fields
+
+
+def _get_migration_names(app_config):
+    module_name, _ = MigrationLoader.migrations_module(app_config.label)
+    if module_name is None:
+        return []
+    try:
+        module = import_module(module_name)
+    except ImportError:
+        return []
+    return sorted(name for _, name, _ in pkgutil.iter_modules(module.__path__))
+
+
+def get_schema_digest():
+    """A digest of what the schema snapshot depends on, the Data Browser version,
+    the installed apps and their migrations.
+
+    Models can't change their fields or choices without a migration, and this is
+    a directory listing per app rather than a walk over every field.
+    """
+    raw = json.dumps(
+        [
+            version,
+            [
+                [app_config.label, _get_migration_names(app_config)]
+                for app_config in apps.get_app_configs()
+            ],
+        ]
+    )
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def build_schema_snapshot():
+    for model in apps.get_models():
+        _get_static_fields(model)
+    return {
+        "version": version,
+        "digest": get_schema_digest(),
+        "models": dict(_static_schema),
+    }
+
+
+def write_schema_snapshot(path):
+    """Write the snapshot to path, via a temporary file in the same directory so
+    processes loading it never see it half written."""
+    snapshot = build_schema_snapshot()
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return snapshot
+
+
+def _snapshot_matches_models(static_schema):
+    models = {get_model_name(model): model for model in apps.get_models()}
+    for model_name, static_fields in static_schema.items():
+        model = models.get(model_name)
+        if model is None:
+            return False
+        if set(static_fields) != {f.name for f in model._meta.get_fields()}:
+            return False
+    return True
+
+
+def load_schema_snapshot(path):
+    """Load a snapshot written by write_schema_snapshot, returns False if it is
+    missing, unreadable or was made from different apps, migrations or Data
+    Browser version."""
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return False
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+        debug_log(f"Ignoring unreadable schema snapshot {path}: {e!r}")
+        return False
+
+    if not isinstance(snapshot, dict) or snapshot.get("version") != version:
+        debug_log(f"Ignoring schema snapshot {path} from a different version")
+        return False
+
+    if snapshot.get("digest") != get_schema_digest() or not _snapshot_matches_models(
+        snapshot["models"]
+    ):
+        debug_log(f"Ignoring schema snapshot {path} made from different models")
+        return False
+
+    _static_schema.update(snapshot["models"])
+    return True
+
+
 def _get_fields_for_model(request, model, admin, admin_fields):
     fields = {}
     orm_models = {}
 
     model_name = get_model_name(model)
-    model_fields = {f.name: f for f in model._meta.get_fields()}
+    static_fields = _get_static_fields(model)
 
     for field_name in admin_fields[model]:
-        field = model_fields.get(field_name)
-        verbose_name = field.verbose_name if field else None
+        static_field = static_fields.get(field_name)
         if field_name == OPEN_IN_ADMIN:
             fields[OPEN_IN_ADMIN] = OrmAdminField(model_name=model_name)
-        elif isinstance(field, (models.ForeignKey, OneToOneRel)):
-            if field.related_model in admin_fields:
+        elif static_field is None:
+            orm_field = _get_calculated_field(
+                request, field_name, model_name, model, admin
+            )
+            if orm_field:
+                fields[field_name] = orm_field
+        elif static_field.kind == "fk":
+            if static_field.related_model in admin_fields:
                 fields[field_name] = OrmFkField(
                     model_name=model_name,
                     name=field_name,
-                    pretty_name=verbose_name or field_name,
-                    rel_name=get_model_name(field.related_model),
+                    pretty_name=static_field.pretty_name,
+                    rel_name=get_model_name(static_field.related_model),
                 )
-        elif isinstance(field, (ForeignObjectRel, models.ManyToManyField)):
-            pass  # TODO 2many support
-        elif isinstance(field, models.FileField):
+        elif static_field.kind == "file":
             fields[field_name] = OrmFileField(
                 model_name=model_name,
                 name=field_name,
-                pretty_name=verbose_name or field_name,
-                django_field=field,
-            )
-        elif isinstance(field, type(None)):
-            orm_field = _get_calculated_field(
-                request, field_name, model_name, model, admin, model_fields
+                pretty_name=static_field.pretty_name,
+                django_field=model._meta.get_field(field_name),
             )
-            if orm_field:
-                fields[field_name] = orm_field
-        else:
-            field_type, choices = _get_field_type(model, field_name, field)
+        elif static_field.kind == "concrete":
+            field_type = static_field.type_
 
             rel_name = field_type.name
             if field_type is JSONType:
@@ -312,24 +529,170 @@ def _get_fields_for_model(request, model, admin, admin_fields):
             fields[field_name] = OrmConcreteField(
                 model_name=model_name,
                 name=field_name,
-                pretty_name=verbose_name or field_name,
+                pretty_name=static_field.pretty_name,
                 type_=field_type,
                 rel_name=rel_name,
-                choices=choices,
+                choices=_fmt_choices(static_field.choices),
             )
     orm_models[model_name] = OrmModel(fields=fields, admin=admin)
     return orm_models
 
 
-def get_models(request):
-    model_admins, admin_fields = _get_all_admin_fields(request)
-    models = {}
-    for model in admin_fields:
-        models.update(
-            _get_fields_for_model(request, model, model_admins[model], admin_fields)
+class LazyOrmModels(Mapping):
+    """Maps model names to OrmModels, building each one on first access.
+
+    Which models and fields are visible is worked out as models are reached,
+    see _AdminFields, building the OrmModel for a model (and any JSON sub models
+    hanging off it) is deferred until something like BoundQuery.bind actually
+    walks into it. Instances are per request unless frozen, see freeze.
+    """
+
+    def __init__(self, request, admin_fields):
+        self._request = request
+        self._admin_fields = admin_fields
+        self._models = {
+            get_model_name(model): model for model in admin_fields.candidates()
+        }
+        self._built = set()
+        self._orm_models = dict(_TYPE_ORM_MODELS)
+
+    def _is_visible(self, model_name):
+        model = self._models.get(model_name)
+        return model is not None and model in self._admin_fields
+
+    def _build(self, model_name):
+        model = self._models[model_name]
+        self._orm_models.update(
+            _get_fields_for_model(
+                self._request,
+                model,
+                self._admin_fields.admin(model),
+                self._admin_fields,
+            )
         )
-    types = {
-        type_.name: OrmModel(get_fields_for_type(type_)) for type_ in TYPES.values()
-    }
+        self._built.add(model_name)
+
+    def __getitem__(self, name):
+        if name not in self._orm_models:
+            # json sub models are named after the model they belong to
+            model_name = name.split("__")[0]
+            if not self._is_visible(model_name) or model_name in self._built:
+                raise KeyError(name)
+            self._build(model_name)
+        return self._orm_models[name]
+
+    def __contains__(self, name):
+        if name in self._orm_models or self._is_visible(name):
+            return True
+        return super().__contains__(name)
+
+    def __iter__(self):
+        self._build_all()
+        return iter(list(self._orm_models))
+
+    def _build_all(self):
+        for model_name in self._models:
+            if model_name not in self._built and self._is_visible(model_name):
+                self._build(model_name)
+
+    def freeze(self):
+        """Build every model and drop the request so this can be shared between
+        requests, nothing is built lazily after this."""
+        self._build_all()
+        self._admin_fields.freeze()
+        self._request = None
+        return self
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def root_admins(self):
+        """The admins of the top level models, without building them."""
+        return {
+            name: self._admin_fields.admin(model)
+            for name, model in self._models.items()
+            if model in self._admin_fields
+        }
+
 
-    return {**models, **types}
+def _get_models(request):
+    return LazyOrmModels(request, _AdminFields(request))
+
+
+_schema_cache = LRUCache("DATA_BROWSER_SCHEMA_CACHE_SIZE")
+_schema_generation = 0
+_SCHEMA_GENERATION_KEY = "data_browser:schema_generation"
+
+
+def _get_schema_generation():
+    shared_cache = get_shared_cache()
+    if shared_cache is None:
+        return _schema_generation
+    return shared_cache.get(_SCHEMA_GENERATION_KEY, 0)
+
+
+def invalidate_schema_cache():
+    """Throw away all cached schemas, in this process and in any process sharing
+    DATA_BROWSER_SHARED_CACHE_ALIAS. Call this when admin configuration changes
+    at runtime."""
+    global _schema_generation
+
+    _schema_generation += 1
+    _schema_cache.clear()
+
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        try:
+            shared_cache.incr(_SCHEMA_GENERATION_KEY)
+        except ValueError:
+            shared_cache.set(_SCHEMA_GENERATION_KEY, 1, None)
+
+
+def schema_cache_info():
+    return _schema_cache.info()
+
+
+def get_schema_fingerprint(request):
+    """A digest of everything the schema depends on that varies between requests.
+
+    Admin visibility is determined by the users effective permissions, so users
+    with the same permissions share a schema. It's worked out once per request
+    and user (public views run as their owner) and again if the schema is
+    invalidated by this process in the meantime.
+    """
+    user, generation = request.user, _schema_generation
+    cached = getattr(request, "data_browser_schema_fingerprint", None)
+    if cached and cached[0] is user and cached[1] == generation:
+        return cached[2]
+
+    fingerprint = _get_schema_fingerprint(request)
+    request.data_browser_schema_fingerprint = (user, generation, fingerprint)
+    return fingerprint
+
+
+def _get_schema_fingerprint(request):
+    user = request.user
+    if user.is_active and user.is_superuser:
+        perms = ["*"]
+    elif user.is_active:
+        perms = sorted(user.get_all_permissions())
+    else:
+        perms = []
+
+    raw = json.dumps(
+        [version, _get_schema_generation(), user.is_active, user.is_staff, perms]
+    )
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def get_models(request):
+    if not settings.DATA_BROWSER_SCHEMA_CACHE_SIZE:
+        return _get_models(request)
+
+    fingerprint = get_schema_fingerprint(request)
+    models = _schema_cache.get(fingerprint)
+    if models is None:
+        # cached schemas outlive the request so they can't build lazily with it
+        models = _get_models(request).freeze()
+        _schema_cache.set(fingerprint, models)
+    return models
@@ -1,3 +1,4 @@
+import functools
 from collections import defaultdict
 from dataclasses import dataclass
 from typing import Sequence, Tuple
@@ -244,6 +245,10 @@ class OrmBoundField:
     def get_format_hints(self, data):
         return self.type_.get_format_hints(self.path_str, data)
 
+    @property
+    def has_format_hints(self):
+        return self.type_.format_hints is not None
+
 
 @dataclass
 class OrmModel:
@@ -278,7 +283,16 @@ class OrmBaseField:
             assert self.type_
 
     def format(self, value):
-        return self.type_.format(value, self.choices)
+        return self.get_formatter()(value)
+
+    def get_formatter(self):
+        return self.type_.get_formatter(self.choices)
+
+    def get_batch_calculator(self):
+        return None
+
+    def get_cache_settings(self):
+        return None
 
 
 class OrmFkField(OrmBaseField):
@@ -340,25 +354,48 @@ class OrmCalculatedField(OrmBaseField):
             model_name=self.model_name,
         )
 
-    def format(self, obj):
-        if obj is None:
+    def get_batch_calculator(self):
+        # admin methods decorated with ddb_batch calculate every obj in one call
+        batch = getattr(getattr(self.admin, self.name, None), "ddb_batch", None)
+        if batch is None:
+            return None
+        return functools.partial(batch, self.admin)
+
+    def get_cache_settings(self):
+        # (timeout, version field) if this fields values are cached across requests
+        cached = getattr(self.admin, "ddb_calculated_fields_cache", {})
+        if self.name not in cached:
             return None
+        version_field = getattr(self.admin, "ddb_calculated_fields_version", None)
+        return cached[self.name], version_field
 
+    def get_calculator(self):
         if hasattr(self.admin, self.name):
             # admin callable
-            func = getattr(self.admin, self.name)
-            try:
-                return func(obj)
-            except Exception as e:
-                return str(e)
+            return getattr(self.admin, self.name)
         else:
             # model property or callable
-            try:
-                value = getattr(obj, self.name)
+            name = self.name
+
+            def calculate(obj):
+                value = getattr(obj, name)
                 return value() if callable(value) else value
+
+            return calculate
+
+    def get_formatter(self):
+        calculate = self.get_calculator()
+
+        def format_(obj):
+            if obj is None:
+                return None
+            try:
+                return calculate(obj)
             except Exception as e:
                 return str(e)
 
+        return format_
+
 
 class OrmBoundAnnotatedField(OrmBoundField):
     def annotate(self, request, qs):
@@ -433,14 +470,17 @@ class OrmAdminField(OrmBaseField):
             model_name=self.model_name,
         )
 
-    def format(self, obj):
-        if obj is None:
-            return None
+    def get_formatter(self):
+        def format_(obj):
+            if obj is None:
+                return None
+
+            model_name = get_model_name(obj.__class__, "_")
+            url_name = f"admin:{model_name}_change".lower()
+            url = reverse(url_name, args=[obj.pk])
+            return f'<a href="{url}">{obj}</a>'
 
-        model_name = get_model_name(obj.__class__, "_")
-        url_name = f"admin:{model_name}_change".lower()
-        url = reverse(url_name, args=[obj.pk])
-        return f'<a href="{url}">{obj}</a>'
+        return format_
 
 
 class OrmFileField(OrmConcreteField):
@@ -450,17 +490,20 @@ class OrmFileField(OrmConcreteField):
         )
         self.django_field = django_field
 
-    def format(self, value):
-        if not value:
-            return None
-        try:
-            # some storage backends will hard fail if their underlying storage isn't
-            # setup right https://github.com/tolomea/django-data-browser/issues/11
-            return format_html(
-                '<a href="{}">{}</a>', self.django_field.storage.url(value), value
-            )
-        except Exception as e:
-            return str(e)
+    def get_formatter(self):
+        storage = self.django_field.storage
+
+        def format_(value):
+            if not value:
+                return None
+            try:
+                # some storage backends will hard fail if their underlying storage
+                # isn't setup right https://github.com/tolomea/django-data-browser/issues/11
+                return format_html('<a href="{}">{}</a>', storage.url(value), value)
+            except Exception as e:
+                return str(e)
+
+        return format_
 
 
 class OrmAggregateField(OrmBaseField):
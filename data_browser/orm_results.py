@@ -1,11 +1,47 @@
+import base64
+import binascii
+import copy
+import hashlib
 import itertools
 import json
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime
+from datetime import time as time_
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache, reduce
+from operator import itemgetter, or_
+from typing import Any, Sequence
+from uuid import UUID
 
-from .orm_admin import admin_get_queryset
-from .orm_fields import _get_django_lookup
+from django.contrib.admin import site
+from django.core.cache import caches
+from django.core.exceptions import EmptyResultSet
+from django.db import DatabaseError, connections, router, transaction
+from django.db.models import Count, F, Max, Q, Window
+from django.db.models.functions import DenseRank
+from django.utils import dateparse
+
+from .common import LRUCache, get_shared_cache, settings
+from .orm_admin import admin_get_queryset, get_schema_fingerprint
+from .orm_fields import _get_django_lookup, get_model_name
 from .query import BoundQuery
-from .types import ASC, DSC
+from .types import (
+    ASC,
+    DSC,
+    ArrayTypeMixin,
+    DateTimeType,
+    DateType,
+    DurationType,
+    JSONType,
+    NumberType,
+    UnknownType,
+)
 
 
 def _filter(qs, filter_, filter_str):
@@ -56,12 +92,93 @@ def _rows_sub_query(bound_query):
     )
 
 
+_ROW_RANK = "ddb_row_rank"
+_COL_RANK = "ddb_col_rank"
+
+
+def _get_pivot_ranks(bound_query, orm_models):
+    """Rank the row and col headers of a pivot in the main query.
+
+    Returns {rank name: window expression} for each header whose order can come
+    from the main query instead of its sub query, the expression is None if the
+    header has no sort fields. Rows sorted on a body field need their sub query
+    as the body values are aggregated across columns there.
+    """
+    model = orm_models[bound_query.model_name].admin.model
+    if not connections[router.db_for_read(model)].features.supports_over_clause:
+        return {}
+
+    ranks = {}
+    for name, sub_query in [
+        (_ROW_RANK, _rows_sub_query(bound_query)),
+        (_COL_RANK, _cols_sub_query(bound_query)),
+    ]:
+        sort_fields = sub_query.sort_fields
+        if not all(f.orm_bound_field.can_pivot for f in sort_fields):
+            continue
+        order_by = [
+            F(f.orm_bound_field.queryset_path).asc()
+            if f.direction is ASC
+            else F(f.orm_bound_field.queryset_path).desc()
+            for f in sort_fields
+        ]
+        ranks[name] = Window(DenseRank(), order_by=order_by) if order_by else None
+    return ranks
+
+
+def _rank_headers(res, ranks, name):
+    if ranks[name] is None:
+        return res
+    return sorted(res, key=itemgetter(name))
+
+
 def get_result_queryset(request, bound_query, orm_models):
+    """The queryset for bound_query as shown by the .sql format and saved with
+    reports, limited to the row limit and sorted by the sort fields alone.
+
+    Results are read with _get_rows_queryset which adds the truncation probe
+    and the paging clauses.
+    """
+    qs = _get_result_queryset(request, bound_query, orm_models, paged=False)
+    return qs[: bound_query.limit]
+
+
+def _get_rows_queryset(
+    request, bound_query, orm_models, ranks=None, where=None, extra_aggregates=None
+):
+    """The queryset results are read from.
+
+    It fetches one row more than the limit so callers can tell if the results
+    were truncated, see _truncate. where (a Q) restricts the rows before anything
+    else happens and extra_aggregates are annotated alongside the queries own
+    aggregates, these are used for incremental refreshes.
+    """
+    qs = _get_result_queryset(
+        request, bound_query, orm_models, ranks, where, extra_aggregates
+    )
+    return qs[: bound_query.limit + 1]
+
+
+def _truncate(rows, limit):
+    return rows[:limit], len(rows) > limit
+
+
+def _get_result_queryset(
+    request,
+    bound_query,
+    orm_models,
+    ranks=None,
+    where=None,
+    extra_aggregates=None,
+    paged=True,
+):
     all_fields = {f.queryset_path: f for f in bound_query.bound_fields}
     all_fields.update({f.queryset_path: f for f in bound_query.bound_filters})
 
     admin = orm_models[bound_query.model_name].admin
     qs = admin_get_queryset(admin, request, {f.split("__")[0] for f in all_fields})
+    if where is not None:
+        qs = qs.filter(where)
 
     # sql functions and qs annotations
     for field in all_fields.values():
@@ -72,17 +189,16 @@ def get_result_queryset(request, bound_query, orm_models):
         if filter_.orm_bound_field.filter_:
             qs = _filter(qs, filter_, filter_.orm_bound_field.queryset_path)
 
+    aggregates = dict(
+        field.aggregate_clause
+        for field in bound_query.bound_fields + bound_query.bound_filters
+        if field.aggregate_clause
+    )
+    aggregates.update(extra_aggregates or {})
+
     # nothing to group on, early out with an aggregate
     if not any(f.group_by for f in bound_query.bound_fields):
-        return [
-            qs.aggregate(
-                **dict(
-                    field.aggregate_clause
-                    for field in bound_query.bound_fields + bound_query.bound_filters
-                    if field.aggregate_clause
-                )
-            )
-        ]
+        return [qs.aggregate(**aggregates)]
 
     # group by
     qs = qs.values(
@@ -90,12 +206,11 @@ def get_result_queryset(request, bound_query, orm_models):
     ).distinct()
 
     # aggregates
+    qs = qs.annotate(**aggregates)
+
+    # pivot header ranks
     qs = qs.annotate(
-        **dict(
-            field.aggregate_clause
-            for field in bound_query.bound_fields + bound_query.bound_filters
-            if field.aggregate_clause
-        )
+        **{name: window for name, window in (ranks or {}).items() if window}
     )
 
     # having, aka filter aggregate fields
@@ -103,101 +218,1132 @@ def get_result_queryset(request, bound_query, orm_models):
         if filter_.orm_bound_field.having:
             qs = _filter(qs, filter_, filter_.orm_bound_field.queryset_path)
 
+    # page, the keys are unique so everything before the cursor can be skipped,
+    # the first page only needs them when it ends in a tie on the sort fields
+    keys = get_page_keys(bound_query) if paged and bound_query.keyset_order else []
+    if keys and bound_query.after:
+        nulls_largest = connections[qs.db].vendor in _NULLS_LARGEST_VENDORS
+        values = decode_cursor(bound_query, bound_query.after)
+        qs = qs.filter(_keyset_filter(keys, values, nulls_largest))
+
     # sort
     sort_fields = []
+    for path, direction in keys or [
+        (f.orm_bound_field.queryset_path, f.direction) for f in bound_query.sort_fields
+    ]:
+        if direction is ASC:
+            sort_fields.append(path)
+        if direction is DSC:
+            sort_fields.append(f"-{path}")
+    return qs.order_by(*sort_fields)
+
+
+# backends that sort nulls after everything else in ascending order
+_NULLS_LARGEST_VENDORS = {"postgresql", "oracle"}
+
+
+def get_page_keys(bound_query):
+    """[(queryset_path, direction)] that uniquely order the rows of an unpivoted
+    query.
+
+    Rows are distinct on the group by fields, so the sort fields followed by the
+    rest of the group by fields are a total order that keyset pagination can
+    resume from. Pivoted and aggregate only queries can't be paged and get [], as
+    do queries with keys whose values can't be put in a cursor and read back.
+    """
+    if bound_query.col_fields:
+        return []
+    group_by = [f.queryset_path for f in bound_query.bound_fields if f.group_by]
+    if not group_by:
+        return []
+
+    keys = {}
     for field in bound_query.sort_fields:
-        if field.direction is ASC:
-            sort_fields.append(field.orm_bound_field.queryset_path)
-        if field.direction is DSC:
-            sort_fields.append(f"-{field.orm_bound_field.queryset_path}")
-    qs = qs.order_by(*sort_fields)
+        keys.setdefault(field.orm_bound_field.queryset_path, field.direction)
+    for path in group_by:
+        keys.setdefault(path, ASC)
 
-    return qs[: bound_query.limit]
+    types = {f.queryset_path: f.type_ for f in bound_query.bound_fields}
+    if any(issubclass(types[path], _UNPAGEABLE_TYPES) for path in keys):
+        return []
+    return list(keys.items())
 
 
-def get_results(request, bound_query, orm_models):
-    if not bound_query.fields:
-        return {"rows": [], "cols": [], "body": []}
+# types whose values don't survive the trip through a cursor
+_UNPAGEABLE_TYPES = (ArrayTypeMixin, JSONType, UnknownType)
 
-    if bound_query.bound_col_fields and bound_query.bound_row_fields:
-        res = list(get_result_queryset(request, bound_query, orm_models))
-        rows_res = list(
-            get_result_queryset(request, _rows_sub_query(bound_query), orm_models)
-        )
-        cols_res = list(
-            get_result_queryset(request, _cols_sub_query(bound_query), orm_models)
+
+def _encode_cursor_value(value):
+    # json with nothing lost, DjangoJSONEncoder cuts datetimes to milliseconds
+    if isinstance(value, (datetime, date, time_)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return value // timedelta(microseconds=1)
+    if isinstance(value, (Decimal, UUID)):
+        return str(value)
+    return value
+
+
+def _decode_cursor_value(type_, value):
+    if value is None:
+        return None
+    if issubclass(type_, DateTimeType):
+        parsed = dateparse.parse_datetime(value) if isinstance(value, str) else None
+    elif issubclass(type_, DateType):
+        parsed = dateparse.parse_date(value) if isinstance(value, str) else None
+    elif issubclass(type_, DurationType):
+        valid = isinstance(value, int) and not isinstance(value, bool)
+        parsed = timedelta(microseconds=value) if valid else None
+    elif issubclass(type_, NumberType) and isinstance(value, str):
+        try:
+            parsed = Decimal(value)
+        except InvalidOperation:
+            parsed = None
+    elif isinstance(value, (str, int, float)):
+        parsed = value
+    else:
+        parsed = None
+
+    if parsed is None:
+        raise ValueError(f"Bad cursor value {value!r}")
+    return parsed
+
+
+def encode_cursor(bound_query, row, keys=None):
+    """The opaque cursor for the page after row, a raw row of the results.
+
+    keys defaults to all the page keys, a prefix of them is enough when row is
+    the last row sharing its values for that prefix."""
+    if keys is None:
+        keys = [path for path, _ in get_page_keys(bound_query)]
+    data = json.dumps([keys, [_encode_cursor_value(row[path]) for path in keys]])
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(bound_query, cursor):
+    """The key values from a cursor, raises ValueError if it's not from a query
+    with the same keys or the values don't parse as the types of the keys.
+
+    The keys of the cursor may be a prefix of the page keys."""
+    try:
+        keys, values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError(f"Bad cursor {cursor!r}")
+    page_keys = [path for path, _ in get_page_keys(bound_query)]
+    if not isinstance(keys, list) or not keys or keys != page_keys[: len(keys)]:
+        raise ValueError(f"Cursor {cursor!r} doesn't match the query")
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError(f"Cursor {cursor!r} doesn't match the query")
+
+    types = {f.queryset_path: f.type_ for f in bound_query.bound_fields}
+    return [_decode_cursor_value(types[key], v) for key, v in zip(keys, values)]
+
+
+def _keyset_filter(keys, values, nulls_largest):
+    # (a, b) > (x, y) spelled out as a > x or (a = x and b > y) with the
+    # direction and null placement of each key taken into account
+    terms = []
+    equal = Q()
+    for (path, direction), value in zip(keys, values):
+        nulls_after = (direction is ASC) == nulls_largest
+        if value is None:
+            if not nulls_after:
+                terms.append(equal & Q(**{f"{path}__isnull": False}))
+            equal &= Q(**{f"{path}__isnull": True})
+        else:
+            lookup = "gt" if direction is ASC else "lt"
+            after = Q(**{f"{path}__{lookup}": value})
+            if nulls_after:
+                after |= Q(**{f"{path}__isnull": True})
+            terms.append(equal & after)
+            equal &= Q(**{path: value})
+    if not terms:
+        return Q(pk__in=[])  # nothing sorts after the cursor
+    return reduce(or_, terms)
+
+
+def get_result_count(request, bound_query, orm_models):
+    """The number of rows bound_query would return without the limit.
+
+    Returns (count, approximate), when DATA_BROWSER_ESTIMATE_COUNTS is set and the
+    database can estimate it the count comes from the query planner.
+    """
+    qs = _get_result_queryset(request, bound_query, orm_models)
+    if isinstance(qs, list):  # aggregate only queries are already evaluated
+        return len(qs), False
+
+    qs = qs.order_by()
+    connection = connections[qs.db]
+    if (
+        settings.DATA_BROWSER_ESTIMATE_COUNTS and connection.vendor == "postgresql"
+    ):  # pragma: postgres
+        sql, params = qs.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"]), True
+    return qs.count(), False
+
+
+_sql_cache = LRUCache("DATA_BROWSER_SQL_CACHE_SIZE")
+
+
+def sql_cache_info():
+    return _sql_cache.info()
+
+
+@dataclass
+class _CompiledQuery:
+    using: str
+    sql: str  # None if the query can't match anything
+    params: Sequence[Any]
+    names: Sequence[str]
+    expressions: Sequence[Any]
+    col_count: int
+    compile_time: float
+
+    @classmethod
+    def compile(cls, qs):
+        start = time.perf_counter()
+        query = qs.query
+        compiler = query.get_compiler(using=qs.db)
+        try:
+            sql, params = compiler.as_sql()
+        except EmptyResultSet:
+            sql, params = None, ()
+        return cls(
+            using=qs.db,
+            sql=sql,
+            params=tuple(params),
+            names=[*query.extra_select, *query.values_select, *query.annotation_select],
+            expressions=[s[0] for s in (compiler.select or [])[: compiler.col_count]],
+            col_count=compiler.col_count,
+            compile_time=time.perf_counter() - start,
         )
+
+    def execute(self):
+        # the same as evaluating the values() queryset, minus building the sql
+        if self.sql is None:
+            return []
+        connection = connections[self.using]
+        with connection.cursor() as cursor:
+            cursor.execute(self.sql, self.params)
+            rows = [row[: self.col_count] for row in cursor.fetchall()]
+
+        compiler = connection.ops.compiler("SQLCompiler")(None, connection, self.using)
+        converters = compiler.get_converters(self.expressions)
+        if converters:
+            rows = compiler.apply_converters(rows, converters)
+        return [dict(zip(self.names, row)) for row in rows]
+
+
+def _get_sql_cache_key(request, bound_query):
+    return (
+        get_schema_fingerprint(request),
+        request.user.pk,  # admin get_queryset implementations often filter on this
+        bound_query.model_name,
+        tuple(
+            (f.path_str, f.pivoted, f.direction, f.priority) for f in bound_query.fields
+        ),
+        tuple(
+            (f.path_str, f.lookup, repr(f.parsed)) for f in bound_query.valid_filters
+        ),
+        bound_query.limit,
+        bound_query.after,
+        bound_query.keyset_order,
+    )
+
+
+def _prepare_rows(request, bound_query, orm_models, ranks=None):
+    """Build the query for bound_query and return a function that runs it.
+
+    Building touches the request (admin_get_queryset) so it has to happen on the
+    request thread, running it is safe to do elsewhere.
+    """
+    # the cache is keyed on the filter values and relative ones like "now" are
+    # different every time, caching them would only push out useful entries
+    relative = any(f.is_relative for f in bound_query.valid_filters)
+    if not settings.DATA_BROWSER_SQL_CACHE_SIZE or relative:
+        qs = _get_rows_queryset(request, bound_query, orm_models, ranks)
+        return lambda: list(qs)
+
+    start = time.perf_counter()
+    key = (_get_sql_cache_key(request, bound_query), tuple(ranks or ()))
+    compiled = _sql_cache.get(key)
+    hit = compiled is not None
+    if hit:
+        compile_time = time.perf_counter() - start  # just the lookup
     else:
-        res = list(get_result_queryset(request, bound_query, orm_models))
-        rows_res = res
-        cols_res = res
+        qs = _get_rows_queryset(request, bound_query, orm_models, ranks)
+        if isinstance(qs, list):  # aggregate only queries are already evaluated
+            return lambda: qs
+        compiled = _CompiledQuery.compile(qs)
+        compile_time = compiled.compile_time
+        _sql_cache.set(key, compiled)
+
+    if hasattr(request, "data_browser_sql_plans"):
+        request.data_browser_sql_plans.append((hit, compile_time))
+    return compiled.execute
+
+
+def _get_rows(request, bound_query, orm_models, ranks=None):
+    return _prepare_rows(request, bound_query, orm_models, ranks)()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.DATA_BROWSER_PIVOT_WORKERS,
+                thread_name_prefix="data_browser",
+            )
+        return _executor
+
+
+def _run_in_worker(func, budget):
+    # each worker thread gets its own connections, don't leave them lying around
+    try:
+        if budget is None:
+            return func()
+        with budget.applied():
+            return func()
+    finally:
+        connections.close_all()
+
+
+def _run_all(funcs, budget=None):
+    """Run the functions returned by _prepare_rows and return their results.
+
+    With DATA_BROWSER_PIVOT_WORKERS set all but the first run concurrently on
+    the worker pool while the first runs on the request thread. The workers
+    connections are held to the requests QueryBudget.
+    """
+    if not settings.DATA_BROWSER_PIVOT_WORKERS or len(funcs) < 2:
+        return [func() for func in funcs]
+
+    executor = _get_executor()
+    futures = [executor.submit(_run_in_worker, f, budget) for f in funcs[1:]]
+    first = funcs[0]()
+    return [first] + [future.result() for future in futures]
+
+
+# how many SQLite VM instructions between checks of the time limit
+_SQLITE_PROGRESS_STEPS = 1000
+
+# the errors the backends raise when a statement is stopped by its time limit
+# or cancelled, query_canceled on Postgres and the MySQL / MariaDB interrupts
+_PG_QUERY_CANCELED = "57014"
+_MYSQL_INTERRUPTED = {1317, 1969, 3024}
+
+_running_queries = {}
+_running_queries_lock = threading.Lock()
+
+
+def _is_interrupted(vendor, exc):
+    if vendor == "sqlite":
+        return str(exc) == "interrupted"
+    if vendor == "postgresql":  # pragma: postgres
+        return getattr(exc.__cause__, "pgcode", None) == _PG_QUERY_CANCELED
+    if vendor == "mysql":  # pragma: mysql
+        return bool(exc.args) and exc.args[0] in _MYSQL_INTERRUPTED
+    return False  # pragma: no cover
+
+
+def _set_query_limits(connection, budget):
+    """Hold connection to the budget, returns the id its queries can be cancelled
+    with from another connection (or None) and a function that clears the limits."""
+    if connection.vendor == "sqlite":
+        return None, _set_sqlite_limits(connection, budget)
+    if connection.vendor == "postgresql":  # pragma: postgres
+        return _set_postgres_limits(connection, budget.timeout)
+    if connection.vendor == "mysql":  # pragma: mysql
+        return _set_mysql_limits(connection, budget.timeout)
+    return None, lambda: None  # pragma: no cover
+
+
+def _set_sqlite_limits(connection, budget):
+    # like the server side limits the deadline is per statement, it runs until
+    # the statement returns its first row so slow readers of a stream aren't cut off
+    deadline = None
+
+    def time_statement(execute, sql, params, many, context):
+        nonlocal deadline
+        if budget.timeout:
+            deadline = time.monotonic() + budget.timeout
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            deadline = None
+
+    def progress():
+        # a true return interrupts the running statement
+        if budget.cancelled:
+            return True
+        return deadline is not None and time.monotonic() > deadline
+
+    def clear():
+        connection.execute_wrappers.remove(time_statement)
+        if connection.connection is not None:
+            connection.connection.set_progress_handler(None, 0)
+
+    connection.execute_wrappers.append(time_statement)
+    connection.connection.set_progress_handler(progress, _SQLITE_PROGRESS_STEPS)
+    return clear
+
+
+def _set_postgres_limits(connection, timeout):  # pragma: postgres
+    with connection.cursor() as cursor:
+        if timeout:
+            cursor.execute("SET statement_timeout = %s", [int(timeout * 1000)])
+        cursor.execute("SELECT pg_backend_pid()")
+        backend_id = cursor.fetchone()[0]
+
+    def clear():
+        if timeout:
+            _reset_setting(connection, "RESET statement_timeout")
+
+    return backend_id, clear
+
+
+def _set_mysql_limits(connection, timeout):  # pragma: mysql
+    if connection.mysql_is_mariadb:
+        setting, value = "max_statement_time", timeout
+    else:
+        setting, value = "max_execution_time", int((timeout or 0) * 1000)
+    with connection.cursor() as cursor:
+        if timeout:
+            cursor.execute(f"SET SESSION {setting} = %s", [value])
+        cursor.execute("SELECT CONNECTION_ID()")
+        backend_id = cursor.fetchone()[0]
+
+    def clear():
+        if timeout:
+            _reset_setting(connection, f"SET SESSION {setting} = DEFAULT")
+
+    return backend_id, clear
+
+
+def _reset_setting(connection, sql):  # pragma: no cover, postgres and mysql
+    if connection.connection is None:
+        return
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+    except DatabaseError:
+        pass  # e.g. the transaction was aborted by the timeout
+
+
+def _kill_query(using, vendor, backend_id):
+    # run on this threads connection, which isn't the one running the query
+    with connections[using].cursor() as cursor:
+        if vendor == "postgresql":  # pragma: postgres
+            cursor.execute("SELECT pg_cancel_backend(%s)", [backend_id])
+        elif vendor == "mysql":  # pragma: mysql
+            cursor.execute("KILL QUERY %s", [backend_id])
+
+
+def _get_running_key(key):
+    raw = repr(key)
+    return f"data_browser:running:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+
+class QueryBudget:
+    """The time limit and cancellation state for the queries of one request.
+
+    The limit applies to each statement and is enforced by the database,
+    statement_timeout on Postgres, max_execution_time on MySQL and a progress
+    handler on SQLite. While the queries of a request with an X-Request-Id header
+    are running they can be cancelled with cancel_query.
+    """
+
+    def __init__(self, request, using):
+        request_id = request.headers.get("X-Request-Id")
+        self.key = (request.user.pk, request_id) if request_id else None
+        self.timeout = settings.DATA_BROWSER_QUERY_TIMEOUT
+        self.using = using
+        self.cancelled = False
+        self._backends = set()
+        self._depth = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def for_request(cls, request, model):
+        """A budget if the request has a time limit or can be cancelled, else None."""
+        if not settings.DATA_BROWSER_QUERY_TIMEOUT and not request.headers.get(
+            "X-Request-Id"
+        ):
+            return None
+        return cls(request, router.db_for_read(model))
+
+    @contextmanager
+    def applied(self):
+        """Hold this threads connection to the budget, can be nested and used from
+        several threads at once. Limits are set and cleared by the outermost use
+        on each thread."""
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        if depth:
+            try:
+                yield
+            finally:
+                self._local.depth -= 1
+            return
+
+        connection = connections[self.using]
+        connection.ensure_connection()
+        backend_id, clear = _set_query_limits(connection, self)
+        backend = (self.using, connection.vendor, backend_id)
+        self._register(backend)
+        try:
+            yield
+        finally:
+            self._local.depth -= 1
+            self._unregister(backend)
+            clear()
+
+    def _register(self, backend):
+        with self._lock:
+            self._depth += 1
+            if backend[2] is not None:
+                self._backends.add(backend)
+            backends = list(self._backends)
+        if self.key is None:
+            return
+
+        with _running_queries_lock:
+            _running_queries[self.key] = self
+        shared_cache = get_shared_cache()
+        if shared_cache is not None and backends:
+            # so other processes can cancel them too, removed by _unregister
+            shared_cache.set(_get_running_key(self.key), backends, None)
+
+    def _unregister(self, backend):
+        with self._lock:
+            self._depth -= 1
+            self._backends.discard(backend)
+            done = not self._depth
+        if self.key is None or not done:
+            return
+
+        with _running_queries_lock:
+            if _running_queries.get(self.key) is self:
+                del _running_queries[self.key]
+        shared_cache = get_shared_cache()
+        if shared_cache is not None:
+            shared_cache.delete(_get_running_key(self.key))
+
+    def cancel(self):
+        self.cancelled = True
+        with self._lock:
+            backends = list(self._backends)
+        for backend in backends:
+            _kill_query(*backend)
+
+    def get_error(self, exc):
+        """The message for a database error if this budget stopped the statement,
+        else None."""
+        if not _is_interrupted(connections[self.using].vendor, exc):
+            return None
+        if self.cancelled or not self.timeout:
+            return "Query cancelled"
+        return f"Query timed out after {self.timeout} seconds"
+
+
+def get_budget(request):
+    return getattr(request, "data_browser_budget", None)
+
+
+def cancel_query(request, request_id):
+    """Cancel the running queries of the current users request with this
+    X-Request-Id, returns False if there weren't any."""
+    key = (request.user.pk, request_id)
+    with _running_queries_lock:
+        budget = _running_queries.get(key)
+    if budget is not None:
+        budget.cancel()
+        return True
+
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        backends = shared_cache.get(_get_running_key(key))
+        if backends:
+            for backend in backends:
+                _kill_query(*backend)
+            return True
+    return False
+
+
+class _FieldPlan:
+    """What the per cell loops in get_results need from a bound field.
+
+    Looked up once per query instead of going through OrmBoundField.__getattr__
+    and rejoining the path for every cell.
+    """
+
+    __slots__ = ["queryset_path", "path_str", "cache_key", "format"]
+
+    def __init__(self, orm_bound_field):
+        self.queryset_path = orm_bound_field.queryset_path
+        self.path_str = orm_bound_field.path_str
+        if _is_precalculated(orm_bound_field):
+            # the values are already calculated, see _load_calculated_objects
+            self.cache_key = _values_key(orm_bound_field)
+            self.format = _identity
+        else:
+            self.cache_key = orm_bound_field.model_name
+            self.format = orm_bound_field.get_formatter()
+
+
+def _identity(value):
+    return value
+
+
+def _values_key(orm_bound_field):
+    return orm_bound_field.model_name, orm_bound_field.name
+
+
+def _is_precalculated(orm_bound_field):
+    return bool(
+        orm_bound_field.get_batch_calculator() or orm_bound_field.get_cache_settings()
+    )
+
+
+def _plan(orm_bound_fields):
+    return tuple(_FieldPlan(field) for field in orm_bound_fields)
+
+
+def _get_dependencies(model, paths):
+    # turn ddb_calculated_fields_depend_on paths into only, select_related and
+    # prefetch_related arguments, single valued relations are joined, many valued
+    # relations are prefetched in full along with any relations beyond them
+    only = set()
+    select_related = set()
+    prefetch_related = set()
+    for path in paths:
+        current = model
+        parts = path.split("__")
+        accessors = []  # prefetch_related wants reverse relations by accessor
+        prefetching = False
+        for i, part in enumerate(parts):
+            prefix = "__".join(parts[: i + 1])
+            field = current._meta.get_field(part)
+            if field.auto_created and not field.concrete:
+                accessors.append(field.get_accessor_name())
+            else:
+                accessors.append(part)
+            if not field.is_relation:
+                if not prefetching:
+                    only.add(prefix)
+                break
+            if prefetching or field.many_to_many or field.one_to_many:
+                prefetch_related.add("__".join(accessors))
+                if i and not prefetching:  # can't defer what we're joining through
+                    only.add("__".join(parts[:i]))
+                prefetching = True
+            else:
+                select_related.add(prefix)
+            current = field.related_model
+        else:
+            if not prefetching:
+                only.add(path)
+    return only, select_related, prefetch_related
+
 
+def _get_calculated_queryset(request, admin, field_names):
+    qs = admin_get_queryset(admin, request, field_names)
+
+    depends_on = getattr(admin, "ddb_calculated_fields_depend_on", {})
+    if not all(name in depends_on for name in field_names):
+        return qs  # at least one of them needs the whole object
+    if qs.query.select_related is True:
+        return qs  # can't tell what get_queryset is joining
+
+    paths = set(itertools.chain.from_iterable(depends_on[n] for n in field_names))
+    version_field = getattr(admin, "ddb_calculated_fields_version", None)
+    if version_field:
+        paths.add(version_field)
+    only, select_related, prefetch_related = _get_dependencies(admin.model, paths)
+
+    # whatever get_queryset already joins or prefetches has to stay loaded
+    def walk(tree, prefix=""):
+        for name, subtree in tree.items():
+            only.add(prefix + name)
+            walk(subtree, f"{prefix}{name}__")
+
+    walk(qs.query.select_related or {})
+    concrete = {f.name for f in admin.model._meta.concrete_fields}
+    for lookup in qs._prefetch_related_lookups:
+        name = getattr(lookup, "prefetch_through", lookup).split("__")[0]
+        if name in concrete:
+            only.add(name)
+
+    return (
+        qs.select_related(*sorted(select_related))
+        .prefetch_related(*sorted(prefetch_related))
+        .only(*sorted(only))
+    )
+
+
+def _load_calculated_objects(request, orm_bound_fields, rows, orm_models):
     # gather up all the objects to fetch for calculated fields
     to_load = defaultdict(set)
     loading_for = defaultdict(set)
-    for field in bound_query.bound_fields:
+    for field in orm_bound_fields:
         if field.model_name:
             loading_for[field.model_name].add(field.name)
             pks = to_load[field.model_name]
-            for row in res:
+            for row in rows:
                 pks.add(row[field.queryset_path])
 
     # fetch all the calculated field objects
     cache = {}
     for model_name, pks in to_load.items():
         admin = orm_models[model_name].admin
-        cache[model_name] = admin_get_queryset(
-            admin, request, loading_for[model_name]
-        ).in_bulk(pks)
-
-    # dump out the results
-    def format_table(fields, data):
-        results = []
-        for row in data:
-            if row:
-                res_row = {}
-                for field in fields:
-                    value = row[field.queryset_path]
-                    if field.model_name:
-                        value = cache[field.model_name].get(value)
-                    res_row[field.path_str] = field.format(value)
-                results.append(res_row)
-            else:
-                results.append(row)
-        return results
+        qs = _get_calculated_queryset(request, admin, loading_for[model_name])
+        objs = cache[model_name] = {}
+        for chunk in _iter_chunks(iter(pks), settings.DATA_BROWSER_CHUNK_SIZE):
+            objs.update(qs.in_bulk(chunk))
+
+    # batch and cached calculated fields are worked out for all objects at once
+    for field in orm_bound_fields:
+        if _is_precalculated(field) and _values_key(field) not in cache:
+            objs = cache[field.model_name]
+            cache[_values_key(field)] = _calculate_values(request, field, objs)
+    return cache
+
+
+_value_cache_stats = {"hits": 0, "misses": 0}
+_value_cache_lock = threading.Lock()
+
+
+def value_cache_info():
+    with _value_cache_lock:
+        return dict(_value_cache_stats)
+
+
+def _get_value_cache():
+    return caches[settings.DATA_BROWSER_CALCULATED_CACHE_ALIAS]
+
+
+def _get_model_version_key(model_name, edits=False):
+    # append only models also count their edits separately, inserts are picked up
+    # from their high water mark instead
+    kind = "model_edits" if edits else "model_version"
+    return f"data_browser:{kind}:{model_name}"
+
+
+def _get_version_keys(models, created=False):
+    keys = set()
+    for model in models:
+        keys.add(_get_model_version_key(get_model_name(model)))
+        if not created and model in _get_append_only_models():
+            keys.add(_get_model_version_key(get_model_name(model), edits=True))
+    return keys
+
+
+def _incr_versions(keys):
+    value_cache = _get_value_cache()
+    for key in keys:
+        try:
+            value_cache.incr(key)
+        except ValueError:
+            value_cache.set(key, 1, None)
+
+
+class _PendingBumps:
+    """The version keys to bump when the transaction on a connection commits,
+    one of these is registered per transaction however many writes it has."""
+
+    def __init__(self):
+        self.keys = set()
+
+    def __call__(self):
+        _incr_versions(self.keys)
+
+
+def _bump_model_versions(models, created=False, using=None):
+    # bumping before the commit would let a concurrent request cache what it
+    # reads from before the commit under the new version
+    keys = _get_version_keys(models, created)
+    connection = connections[using or router.db_for_write(next(iter(models)))]
+    if not connection.in_atomic_block:
+        _incr_versions(keys)
+        return
+
+    # rolling back (a savepoint) drops the callback along with the transaction
+    pending = getattr(connection, "data_browser_pending_bumps", None)
+    if pending is None or not any(
+        entry[1] is pending for entry in connection.run_on_commit
+    ):
+        pending = _PendingBumps()
+        connection.data_browser_pending_bumps = pending
+        transaction.on_commit(pending, using=connection.alias)
+    pending.keys.update(keys)
+
+
+def invalidate_model_cache(*models):
+    """Throw away the cached results and calculated values that depend on these
+    models. Saves and deletes do this automatically, call it after bulk updates and
+    raw SQL writes. Inside a transaction it happens when the transaction commits."""
+    _bump_model_versions(models)
+
+
+def bump_model_version(sender, **kwargs):
+    """post_save / post_delete / m2m_changed receiver that invalidates the cached
+    results and calculated values of the changed models once the write commits."""
+    if "action" in kwargs:  # m2m_changed, both ends and the through model change
+        if not kwargs["action"].startswith("post_"):
+            return
+        models = {sender, type(kwargs["instance"]), kwargs["model"]}
+    else:
+        models = {sender}
+
+    if not settings.DATA_BROWSER_RESULTS_CACHE_TIMEOUT:
+        # only calculated values that aren't versioned by a field care
+        models &= _get_versioned_models()
+    if models:
+        _bump_model_versions(
+            models, created=kwargs.get("created", False), using=kwargs.get("using")
+        )
+
+
+def _get_append_only_column(admin):
+    column = getattr(admin, "ddb_append_only", None)
+    if column is True:
+        return admin.model._meta.pk.name
+    return column or None
+
 
-    def get_fields(row, fields):
-        res = []
-        for field in fields:
-            v = row[field.queryset_path]
-            if isinstance(v, list):  # pragma: postgres
-                v = tuple(v)
+@lru_cache(maxsize=None)
+def _get_append_only_models():
+    res = set()
+    for model_admin in site._registry.values():
+        for admin in [model_admin, *model_admin.inlines]:
+            if getattr(admin, "ddb_append_only", None):
+                res.add(admin.model)
+    return frozenset(res)
+
+
+@lru_cache(maxsize=None)
+def _get_versioned_models():
+    # models with cached calculated fields and no version field on any admin
+    res = set()
+    for model_admin in site._registry.values():
+        for admin in [model_admin, *model_admin.inlines]:
+            if getattr(admin, "ddb_calculated_fields_cache", None) and not getattr(
+                admin, "ddb_calculated_fields_version", None
+            ):
+                res.add(admin.model)
+    return frozenset(res)
+
+
+def _get_value_cache_key(field, model_version, obj, version_field):
+    version = getattr(obj, version_field) if version_field else model_version
+    raw = repr((field.model_name, field.name, obj.pk, str(version)))
+    return f"data_browser:calculated:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+
+def _calculate_values(request, field, objs):
+    """pk -> value for the objs of a batch or cached calculated field.
+
+    Errors are reported in place of the value like the per cell path does and are
+    never cached.
+    """
+    cached = {}
+    cache_settings = field.get_cache_settings()
+    if cache_settings:
+        timeout, version_field = cache_settings
+        value_cache = _get_value_cache()
+        model_version = None
+        if not version_field:
+            model_version = value_cache.get(_get_model_version_key(field.model_name))
+        keys = {
+            pk: _get_value_cache_key(field, model_version, obj, version_field)
+            for pk, obj in objs.items()
+        }
+        found = value_cache.get_many(list(keys.values()))
+        cached = {pk: found[key] for pk, key in keys.items() if key in found}
+
+        hits, misses = len(cached), len(objs) - len(cached)
+        with _value_cache_lock:
+            _value_cache_stats["hits"] += hits
+            _value_cache_stats["misses"] += misses
+        if hasattr(request, "data_browser_value_cache"):
+            request.data_browser_value_cache.append((field.path_str, hits, misses))
+
+    todo = [obj for pk, obj in objs.items() if pk not in cached]
+    calculated = {}
+    errors = {}
+    batch = field.get_batch_calculator()
+    if batch:
+        try:
+            calculated = batch(todo)
+        except Exception as e:
+            errors = {obj.pk: str(e) for obj in todo}
+    elif todo:
+        calculate = field.get_calculator()
+        for obj in todo:
             try:
-                hash(v)
-            except TypeError:
-                v = json.dumps(v)
-            res.append((field.queryset_path, v))
-        return tuple(res)
+                calculated[obj.pk] = calculate(obj)
+            except Exception as e:
+                errors[obj.pk] = str(e)
+
+    if cache_settings and calculated:
+        value_cache.set_many(
+            {keys[pk]: value for pk, value in calculated.items() if pk in keys},
+            timeout,
+        )
+    return {**calculated, **errors, **cached}
+
+
+def _format_table(fields, data, cache):
+    # format a column at a time so each fields formatter runs in a tight map()
+    present = [row for row in data if row]
+    results = [{} for _ in present]
+    for field in fields:
+        values = [row[field.queryset_path] for row in present]
+        objs = cache.get(field.cache_key)
+        if objs is not None:
+            values = map(objs.get, values)
+        path_str = field.path_str
+        for res_row, value in zip(results, map(field.format, values)):
+            res_row[path_str] = value
+
+    if len(present) == len(data):
+        return results
+    results = iter(results)
+    return [next(results) if row else row for row in data]
+
+
+def _get_fields(row, fields):
+    res = []
+    for field in fields:
+        v = row[field.queryset_path]
+        if isinstance(v, list):  # pragma: postgres
+            v = tuple(v)
+        try:
+            hash(v)
+        except TypeError:
+            v = json.dumps(v)
+        res.append((field.queryset_path, v))
+    return tuple(res)
+
+
+class Truncation:
+    """Set by iter_results_flat once it has seen whether there are more rows than
+    the limit, and if so the cursor for the next page."""
+
+    truncated = False
+    next = None
+
+
+def _iter_rows(request, bound_query, orm_models, truncation):
+    budget = get_budget(request)
+    if budget is None:
+        yield from _iter_query_rows(request, bound_query, orm_models, truncation)
+        return
+
+    # streamed responses are read after the view has returned, closing the
+    # response (e.g. when the client goes away) closes the cursor and the budget
+    with budget.applied():
+        yield from _iter_query_rows(request, bound_query, orm_models, truncation)
+
+
+def _iter_query_rows(request, bound_query, orm_models, truncation):
+    # on postgres iterator() uses a named server side cursor, elsewhere it fetches
+    # from the client side cursor in chunks rather than all at once
+    qs = _get_rows_queryset(request, bound_query, orm_models)
+    if isinstance(qs, list):  # aggregate only queries are already evaluated
+        rows = iter(qs)
+    else:
+        rows = qs.iterator(chunk_size=settings.DATA_BROWSER_CHUNK_SIZE)
+
+    last = None
+    for last in itertools.islice(rows, bound_query.limit):
+        yield last
+    probe = next(rows, None)
+    truncation.truncated = probe is not None
+    # the rows are already out so a page that ends in a tie can't be refetched
+    truncation.next = _get_next_cursor(bound_query, [last], probe) or None
+
+
+def _iter_chunks(rows, chunk_size):
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_results_flat(request, bound_query, orm_models, truncation=None):
+    """Yield the formatted rows of an unpivoted query a chunk at a time.
+
+    Rows are read from the database cursor DATA_BROWSER_CHUNK_SIZE at a time and
+    calculated field objects are loaded per chunk so memory use doesn't grow with
+    the number of rows. If a Truncation is passed it's updated at the end.
+    """
+    assert not bound_query.col_fields
+    if not bound_query.fields:
+        return
+
+    plan = _plan(bound_query.bound_row_fields)
+    rows = _iter_rows(request, bound_query, orm_models, truncation or Truncation())
+    for chunk in _iter_chunks(rows, settings.DATA_BROWSER_CHUNK_SIZE):
+        cache = _load_calculated_objects(
+            request, bound_query.bound_fields, chunk, orm_models
+        )
+        data = [dict(_get_fields(row, plan)) for row in chunk]
+        yield _format_table(plan, data, cache)
+
+
+def get_format_hints(fields, tables):
+    # the tables are fed through one at a time rather than concatenated
+    res = {}
+    for field in fields:
+        if field.has_format_hints:
+            hints = field.type_.format_hints()
+            for table in tables:
+                hints.add(row[field.path_str] for row in table if row)
+            res[field.path_str] = hints.get()
+        else:
+            res[field.path_str] = {}
+    return res
+
+
+def get_results(request, bound_query, orm_models):
+    if not bound_query.fields:
+        return {"rows": [], "cols": [], "body": []}
+
+    if bound_query.bound_col_fields and bound_query.bound_row_fields:
+        ranks = _get_pivot_ranks(bound_query, orm_models)
+        sub_queries = {
+            _ROW_RANK: _rows_sub_query(bound_query),
+            _COL_RANK: _cols_sub_query(bound_query),
+        }
+
+        # sub queries we know we'll need run alongside the main query
+        needed = [name for name in sub_queries if name not in ranks]
+        res, *results = _run_all(
+            [_prepare_rows(request, bound_query, orm_models, ranks)]
+            + [_prepare_rows(request, sub_queries[n], orm_models) for n in needed],
+            get_budget(request),
+        )
+        res, truncated = _truncate(res, bound_query.limit)
+        headers = dict(zip(needed, results))
+
+        # if the main query got everything the headers can be ordered from it
+        if not truncated:
+            for name in ranks:
+                headers[name] = _rank_headers(res, ranks, name)
+        else:
+            missing = [name for name in sub_queries if name not in headers]
+            results = _run_all(
+                [_prepare_rows(request, sub_queries[n], orm_models) for n in missing],
+                get_budget(request),
+            )
+            headers.update(zip(missing, results))
+
+        # the sub queries are limited independently of the main query
+        rows_res, rows_truncated = _truncate(headers[_ROW_RANK], bound_query.limit)
+        cols_res, cols_truncated = _truncate(headers[_COL_RANK], bound_query.limit)
+        truncated = truncated or rows_truncated or cols_truncated
+        next_cursor = None
+    else:
+        res = _get_rows(request, bound_query, orm_models)
+        next_cursor = _get_next_cursor(bound_query, *_split_probe(res, bound_query))
+        if next_cursor is False:
+            bound_query = with_keyset_order(bound_query)
+            res = _get_rows(request, bound_query, orm_models)
+            next_cursor = _get_next_cursor(bound_query, *_split_probe(res, bound_query))
+        res, truncated = _truncate(res, bound_query.limit)
+        rows_res = res
+        cols_res = res
+
+    return _build_results(
+        request,
+        bound_query,
+        orm_models,
+        res,
+        rows_res,
+        cols_res,
+        truncated,
+        next_cursor,
+    )
+
+
+def with_keyset_order(bound_query):
+    """A copy of bound_query that sorts by all the page keys."""
+    bound_query = copy.copy(bound_query)
+    bound_query.keyset_order = True
+    return bound_query
+
+
+def _split_probe(rows, bound_query):
+    # rows are fetched one past the limit to find out if there are more
+    limit = bound_query.limit
+    return rows[:limit], rows[limit] if len(rows) > limit else None
+
+
+def _get_next_cursor(bound_query, res, probe):
+    """The cursor for the page after res, probe is the row after it or None.
+
+    Sorting by all the page keys isn't free, so the first page is only sorted by the
+    sort fields. If it ends between rows that differ on them a cursor on just
+    those is enough, if it ends in a tie False is returned and the page has to
+    be fetched again with_keyset_order.
+    """
+    keys = get_page_keys(bound_query)
+    if probe is None or not keys:
+        return None
+    last = res[-1]
+    if bound_query.keyset_order:
+        return encode_cursor(bound_query, last)
+
+    sort_paths = {f.orm_bound_field.queryset_path for f in bound_query.sort_fields}
+    prefix = [path for path, _ in keys if path in sort_paths]
+    for i, path in enumerate(prefix):
+        if last[path] != probe[path]:
+            return encode_cursor(bound_query, last, prefix[: i + 1])
+    return False
+
+
+def _build_results(
+    request, bound_query, orm_models, res, rows_res, cols_res, truncated, next_cursor
+):
+    # turn the raw query rows into the rows / cols / body tables
+    cache = _load_calculated_objects(request, bound_query.bound_fields, res, orm_models)
+
+    row_plan = _plan(bound_query.bound_row_fields)
+    col_plan = _plan(bound_query.bound_col_fields)
+    data_plan = _plan(bound_query.bound_data_fields)
 
     data = defaultdict(dict)
     all_row_keys = set()
     all_col_keys = set()
     for row in res:
-        row_key = get_fields(row, bound_query.bound_row_fields)
-        col_key = get_fields(row, bound_query.bound_col_fields)
-        data[row_key][col_key] = dict(get_fields(row, bound_query.bound_data_fields))
+        row_key = _get_fields(row, row_plan)
+        col_key = _get_fields(row, col_plan)
+        data[row_key][col_key] = dict(_get_fields(row, data_plan))
         all_row_keys.add(row_key)
         all_col_keys.add(col_key)
 
     col_keys = {}  # abuse dict to preserve order while removing duplicates
     for row in cols_res:
-        key = get_fields(row, bound_query.bound_col_fields)
+        key = _get_fields(row, col_plan)
         if key in all_col_keys:
             col_keys[key] = None
 
     row_keys = {}  # abuse dict to preserve order while removing duplicates
     for row in rows_res:
-        key = get_fields(row, bound_query.bound_row_fields)
+        key = _get_fields(row, row_plan)
         if key in all_row_keys:
             row_keys[key] = None
 
@@ -206,29 +1352,264 @@ def get_results(request, bound_query, orm_models):
         table = []
         for row_key in row_keys:
             table.append(data[row_key].get(col_key, None))
-        body_data.append(format_table(bound_query.bound_data_fields, table))
+        body_data.append(_format_table(data_plan, table, cache))
 
-    row_data = format_table(
-        bound_query.bound_row_fields, [dict(row) for row in row_keys]
-    )
-    col_data = format_table(
-        bound_query.bound_col_fields, [dict(col) for col in col_keys]
-    )
+    row_data = _format_table(row_plan, [dict(row) for row in row_keys], cache)
+    col_data = _format_table(col_plan, [dict(col) for col in col_keys], cache)
 
-    format_hints = {}
-    for fields, data in [
-        (bound_query.bound_row_fields, row_data),
-        (bound_query.bound_col_fields, col_data),
-        (bound_query.bound_data_fields, list(itertools.chain.from_iterable(body_data))),
-    ]:
-        format_hints.update(
-            {field.path_str: field.get_format_hints(data) for field in fields}
-        )
+    format_hints = {
+        **get_format_hints(bound_query.bound_row_fields, [row_data]),
+        **get_format_hints(bound_query.bound_col_fields, [col_data]),
+        **get_format_hints(bound_query.bound_data_fields, body_data),
+    }
 
     return {
         "rows": row_data,
         "cols": col_data,
         "body": body_data,
         "length": len(res),
+        "truncated": truncated,
+        "next": next_cursor,
         "formatHints": format_hints,
     }
+
+
+_results_cache_stats = {"hits": 0, "misses": 0, "merges": 0}
+_results_cache_lock = threading.Lock()
+
+
+def results_cache_info():
+    with _results_cache_lock:
+        return dict(_results_cache_stats)
+
+
+def _get_query_model_names(bound_query):
+    names = {bound_query.model_name}
+    for orm_bound_field in bound_query.bound_fields + bound_query.bound_filters:
+        while orm_bound_field and orm_bound_field.field:
+            names.add(orm_bound_field.field.model_name)
+            orm_bound_field = orm_bound_field.previous
+    return sorted(names)
+
+
+def _bucket_filter_value(bound_filter):
+    # "today" parses to a date which is already stable for the day, "now" is
+    # rounded down so it doesn't make every request a miss
+    value = bound_filter.parsed
+    if isinstance(value, datetime) and bound_filter.is_relative:
+        bucket = settings.DATA_BROWSER_RESULTS_CACHE_NOW_BUCKET
+        return ("now", int(value.timestamp() // bucket) if bucket else value)
+    return value
+
+
+def _get_results_cache_key(request, bound_query, value_cache, append_only):
+    model_version_keys = [
+        _get_model_version_key(
+            name, edits=append_only and name == bound_query.model_name
+        )
+        for name in _get_query_model_names(bound_query)
+    ]
+    model_versions = value_cache.get_many(model_version_keys)
+    raw = repr(
+        (
+            get_schema_fingerprint(request),
+            request.user.pk,  # as with the sql cache, get_queryset may filter on this
+            bound_query.model_name,
+            tuple(
+                (f.path_str, f.pivoted, f.direction, f.priority)
+                for f in bound_query.fields
+            ),
+            tuple(
+                sorted(
+                    (f.path_str, f.lookup, repr(_bucket_filter_value(f)))
+                    for f in bound_query.valid_filters
+                )
+            ),
+            bound_query.limit,
+            bound_query.after,
+            tuple((key, model_versions.get(key)) for key in model_version_keys),
+        )
+    )
+    return f"data_browser:results:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+
+class _AggregateMerge:
+    """Merges the raw rows of an incremental refresh into the cached raw rows.
+
+    Each aggregate is combined with its rule, averages are weighted by a hidden
+    count of the values that went into them.
+    """
+
+    def __init__(self, group_paths, rules, extra_aggregates):
+        self.group_paths = group_paths
+        self.rules = rules
+        self.extra_aggregates = extra_aggregates
+
+    @classmethod
+    def for_query(cls, bound_query, model):
+        # anything where new rows can move rows in or out of the results or
+        # reorder them can't be merged
+        if not bound_query.fields or bound_query.col_fields or bound_query.after:
+            return None
+        if any(f.orm_bound_field.having for f in bound_query.valid_filters):
+            return None
+        if any(
+            f.direction and f.orm_bound_field.aggregate_clause
+            for f in bound_query.fields
+        ):
+            return None
+
+        rules = {}
+        extra_aggregates = {}
+        for field in bound_query.bound_fields:
+            if not field.aggregate_clause:
+                continue
+            path = field.queryset_path
+            if field.name in {"sum", "min", "max"}:
+                rules[path] = field.name
+            elif field.name == "count" and field.previous.full_path == [
+                model._meta.pk.name
+            ]:
+                # counts are distinct, but new pks are always distinct
+                rules[path] = "sum"
+            elif field.name == "average":
+                count_path = f"ddb_count__{path}"
+                extra_aggregates[count_path] = Count(field.previous.queryset_path)
+                rules[path] = "average"
+                rules[count_path] = "sum"
+            else:
+                return None
+
+        group_paths = [f.queryset_path for f in bound_query.bound_fields if f.group_by]
+        return cls(group_paths, rules, extra_aggregates)
+
+    def merge(self, rows, new_rows, limit):
+        """Return the merged rows or None if new_rows don't fit in rows."""
+        if len(new_rows) > limit:
+            return None  # there are more we didn't get
+
+        merged = {tuple(row[p] for p in self.group_paths): dict(row) for row in rows}
+        for new_row in new_rows:
+            row = merged.get(tuple(new_row[p] for p in self.group_paths))
+            if row is None:
+                return None  # a new group, we don't know where it would sort
+
+            # averages first while the counts are still unmerged
+            for path, rule in self.rules.items():
+                if rule == "average":
+                    old_n = row[f"ddb_count__{path}"]
+                    new_n = new_row[f"ddb_count__{path}"]
+                    if not old_n:
+                        row[path] = new_row[path]
+                    elif new_n:
+                        total = row[path] * old_n + new_row[path] * new_n
+                        row[path] = total / (old_n + new_n)
+            for path, rule in self.rules.items():
+                old, new = row[path], new_row[path]
+                if rule == "average":
+                    continue
+                elif old is None or new is None:
+                    row[path] = new if old is None else old
+                elif rule == "sum":
+                    row[path] = old + new
+                elif rule == "min":
+                    row[path] = min(old, new)
+                else:  # max
+                    row[path] = max(old, new)
+        return list(merged.values())
+
+
+def _get_raw_rows(request, bound_query, orm_models, where, merge):
+    return list(
+        _get_rows_queryset(
+            request,
+            bound_query,
+            orm_models,
+            where=where,
+            extra_aggregates=merge.extra_aggregates,
+        )
+    )
+
+
+def _get_incremental_results(request, bound_query, orm_models, column, key, timeout):
+    """Results for a query on an append only model.
+
+    Cache entries remember the high water mark of the column they were
+    calculated up to, if it's moved on and the query only has mergeable
+    aggregates only the new rows are aggregated and merged in.
+    """
+    value_cache = _get_value_cache()
+    model = orm_models[bound_query.model_name].admin.model
+    mark = model._default_manager.aggregate(mark=Max(column))["mark"]
+
+    entry = value_cache.get(key)
+    if entry is not None and entry["mark"] == mark:
+        _count_results_cache("hits")
+        return entry["results"]
+
+    merge = _AggregateMerge.for_query(bound_query, model)
+    rows = None
+    if merge and entry is not None and None not in (entry["rows"], entry["mark"]):
+        where = Q(**{f"{column}__gt": entry["mark"], f"{column}__lte": mark})
+        new_rows = _get_raw_rows(request, bound_query, orm_models, where, merge)
+        rows = merge.merge(entry["rows"], new_rows, bound_query.limit)
+        # merging doesn't add groups or touch the sort so the page ends the same
+        truncated = entry["results"]["truncated"]
+        next_cursor = entry["results"]["next"]
+
+    if rows is not None:
+        _count_results_cache("merges")
+    else:
+        _count_results_cache("misses")
+        if merge and mark is not None:
+            # rows without a mark are left out of merges but not recomputes
+            where = Q(**{f"{column}__lte": mark}) | Q(**{f"{column}__isnull": True})
+            rows = _get_raw_rows(request, bound_query, orm_models, where, merge)
+            next_cursor = _get_next_cursor(
+                bound_query, *_split_probe(rows, bound_query)
+            )
+            rows, truncated = _truncate(rows, bound_query.limit)
+            if next_cursor is False:  # needs the full order, leave it to get_results
+                rows = None
+
+    if rows is not None:
+        results = _build_results(
+            request, bound_query, orm_models, rows, rows, rows, truncated, next_cursor
+        )
+    else:
+        results = get_results(request, bound_query, orm_models)
+
+    value_cache.set(key, {"mark": mark, "rows": rows, "results": results}, timeout)
+    return results
+
+
+def _count_results_cache(stat):
+    with _results_cache_lock:
+        _results_cache_stats[stat] += 1
+
+
+def get_cached_results(request, bound_query, orm_models):
+    """get_results through the DATA_BROWSER_RESULTS_CACHE_TIMEOUT results cache.
+
+    Entries are invalidated when any model the query touches is saved or deleted,
+    the timeout covers changes the signals can't see. Queries on append only
+    models are refreshed incrementally where possible.
+    """
+    timeout = settings.DATA_BROWSER_RESULTS_CACHE_TIMEOUT
+    if not timeout:
+        return get_results(request, bound_query, orm_models)
+
+    column = _get_append_only_column(orm_models[bound_query.model_name].admin)
+    value_cache = _get_value_cache()
+    key = _get_results_cache_key(request, bound_query, value_cache, bool(column))
+    if column:
+        return _get_incremental_results(
+            request, bound_query, orm_models, column, key, timeout
+        )
+
+    res = value_cache.get(key)
+    _count_results_cache("hits" if res is not None else "misses")
+    if res is None:
+        res = get_results(request, bound_query, orm_models)
+        value_cache.set(key, res, timeout)
+    return res
@@ -4,7 +4,7 @@ from typing import Any, Optional, Sequence
 
 from django.urls import reverse
 
-from .common import settings
+from .common import LRUCache, settings
 from .types import ASC, DSC
 
 
@@ -30,6 +30,10 @@ class QueryFilter:
         self.path = self.path.split("__")
 
 
+def _filter_key(query_filter):
+    return tuple(query_filter.path), query_filter.lookup, query_filter.value
+
+
 def parse_sort(value, symbol, direction):
     path, priority = value.split(symbol)
     try:
@@ -44,6 +48,7 @@ class Query:
     fields: Sequence[QueryField]
     filters: Sequence[QueryFilter]
     limit: int = settings.DATA_BROWSER_DEFAULT_ROW_LIMIT
+    after: str = None  # keyset pagination cursor, see orm_results.encode_cursor
 
     @classmethod
     def from_request(cls, model_name, field_str, get_args):
@@ -73,6 +78,7 @@ class Query:
                     fields.append(QueryField(path, pivoted, direction, priority))
 
         limit = settings.DATA_BROWSER_DEFAULT_ROW_LIMIT
+        after = None
 
         filters = []
         for path__lookup, values in dict(get_args).items():
@@ -82,11 +88,23 @@ class Query:
                         limit = max(1, int(value))
                     except:  # noqa: E722  input sanitization
                         pass
+                if path__lookup == "after":
+                    after = value or None
                 if "__" in path__lookup:
                     path, lookup = path__lookup.rsplit("__", 1)
                     filters.append(QueryFilter(path, lookup, value))
 
-        return cls(model_name, fields, filters, limit)
+        return cls(model_name, fields, filters, limit, after)
+
+    @property
+    def normalized(self):
+        # column order, sort priorities, filter order and the limit don't
+        # change how the paths bind, so they are left out
+        return (
+            self.model_name,
+            tuple(sorted({tuple(field.path) for field in self.fields})),
+            tuple(sorted({_filter_key(filter_) for filter_ in self.filters}, key=str)),
+        )
 
     @property
     def _field_str(self):
@@ -150,6 +168,10 @@ class BoundFilter(BoundFieldMixin):
         )
         self.is_valid = not self.err_message
 
+    @property
+    def is_relative(self):
+        return self.orm_bound_field.type_.is_relative(self.lookup, self.value)
+
 
 @dataclass
 class BoundField(BoundFieldMixin):
@@ -172,15 +194,46 @@ def _orm_fields(fields):
     return [f.orm_bound_field for f in fields]
 
 
+_bind_cache = LRUCache("DATA_BROWSER_QUERY_CACHE_SIZE")
+
+
+def bind_cache_info():
+    return _bind_cache.info()
+
+
 class BoundQuery:
-    def __init__(self, model_name, fields, filters, limit):
+    def __init__(self, model_name, fields, filters, limit, after=None):
         self.model_name = model_name
         self.fields = fields
         self.filters = filters
         self.limit = limit
+        self.after = after
+        # pages after the first are sorted by all the page keys, see orm_results
+        self.keyset_order = bool(after)
+
+        # bound queries are never modified, so work out the partitions up front
+        self.sort_fields = sorted(
+            (f for f in fields if f.direction), key=lambda f: f.priority
+        )
+        self.valid_filters = [f for f in filters if f.is_valid]
+        self.col_fields = [f for f in fields if f.pivoted]
+        if self.col_fields:
+            self.row_fields = [
+                f for f in fields if f.orm_bound_field.can_pivot and not f.pivoted
+            ]
+            self.data_fields = [f for f in fields if not f.orm_bound_field.can_pivot]
+        else:
+            self.row_fields = fields
+            self.data_fields = []
+
+        self.bound_fields = _orm_fields(self.fields)
+        self.bound_filters = _orm_fields(self.valid_filters)
+        self.bound_col_fields = _orm_fields(self.col_fields)
+        self.bound_row_fields = _orm_fields(self.row_fields)
+        self.bound_data_fields = _orm_fields(self.data_fields)
 
     @classmethod
-    def bind(cls, query, orm_models):
+    def _bind_paths(cls, query, orm_models):
         def get_orm_field(parts):
             model_name = query.model_name
             orm_bound_field = None
@@ -196,66 +249,54 @@ class BoundQuery:
                 return None
             return orm_bound_field
 
-        model_name = query.model_name
-
-        fields = []
+        fields = {}
         for query_field in query.fields:
-            orm_bound_field = get_orm_field(query_field.path)
-            if orm_bound_field:
-                fields.append(BoundField.bind(orm_bound_field, query_field))
+            fields[tuple(query_field.path)] = get_orm_field(query_field.path)
 
-        filters = []
+        filters = {}
         for query_filter in query.filters:
             orm_bound_field = get_orm_field(query_filter.path)
             if orm_bound_field and orm_bound_field.concrete:
-                filters.append(BoundFilter.bind(orm_bound_field, query_filter))
-
-        return cls(model_name, fields, filters, query.limit)
-
-    @property
-    def sort_fields(self):
-        return sorted((f for f in self.fields if f.direction), key=lambda f: f.priority)
+                bound_filter = BoundFilter.bind(orm_bound_field, query_filter)
+            else:
+                bound_filter = None
+            filters[_filter_key(query_filter)] = bound_filter
 
-    @property
-    def valid_filters(self):
-        return [f for f in self.filters if f.is_valid]
-
-    @property
-    def col_fields(self):
-        return [f for f in self.fields if f.pivoted]
+        return fields, filters
 
-    @property
-    def row_fields(self):
-        if self.col_fields:
-            return [
-                f for f in self.fields if f.orm_bound_field.can_pivot and not f.pivoted
-            ]
-        else:
-            return self.fields
-
-    @property
-    def data_fields(self):
-        if self.col_fields:
-            return [f for f in self.fields if not f.orm_bound_field.can_pivot]
+    @classmethod
+    def bind(cls, query, orm_models, fingerprint=None):
+        """Bind the query against the models.
+
+        If a schema fingerprint is given and DATA_BROWSER_QUERY_CACHE_SIZE is set
+        the bound paths and parsed filters are cached on the normalized query.
+        """
+        if fingerprint is None or not settings.DATA_BROWSER_QUERY_CACHE_SIZE:
+            cached = False
+            bound_fields, bound_filters = cls._bind_paths(query, orm_models)
         else:
-            return []
-
-    @property
-    def bound_fields(self):
-        return _orm_fields(self.fields)
+            key = (fingerprint, query.normalized)
+            res = _bind_cache.get(key)
+            cached = res is not None
+            if not cached:
+                res = cls._bind_paths(query, orm_models)
+                _bind_cache.set(key, res)
+            bound_fields, bound_filters = res
 
-    @property
-    def bound_filters(self):
-        return _orm_fields(self.valid_filters)
-
-    @property
-    def bound_col_fields(self):
-        return _orm_fields(self.col_fields)
-
-    @property
-    def bound_row_fields(self):
-        return _orm_fields(self.row_fields)
+        fields = []
+        for query_field in query.fields:
+            orm_bound_field = bound_fields[tuple(query_field.path)]
+            if orm_bound_field:
+                fields.append(BoundField.bind(orm_bound_field, query_field))
 
-    @property
-    def bound_data_fields(self):
-        return _orm_fields(self.data_fields)
+        filters = []
+        for query_filter in query.filters:
+            bound_filter = bound_filters[_filter_key(query_filter)]
+            if bound_filter:
+                if cached and bound_filter.is_relative:
+                    bound_filter = BoundFilter.bind(
+                        bound_filter.orm_bound_field, query_filter
+                    )
+                filters.append(bound_filter)
+
+        return cls(query.model_name, fields, filters, query.limit, query.after)
@@ -1,12 +1,13 @@
 import datetime
 import json
-from functools import lru_cache
+from functools import lru_cache, partial
+from types import MappingProxyType
 
 import dateutil.parser
-from django.utils import dateparse, timezone
-from django.utils.formats import date_format
+from django.utils import dateformat, dateparse, timezone
+from django.utils.formats import get_format
 
-from .common import all_subclasses, get_optimal_decimal_places
+from .common import OptimalDecimalPlaces, all_subclasses
 
 ASC, DSC = "asc", "dsc"
 
@@ -17,12 +18,11 @@ class TypeMeta(type):
 
     @property
     def default_lookup(cls):
-        lookups = cls.lookups
-        return list(lookups)[0] if lookups else None
+        return cls._default_lookup
 
     @property
     def lookups(cls):
-        return {name: type_.name for name, type_ in cls._lookups().items()}
+        return cls._lookup_names
 
     @property
     def name(cls):
@@ -34,6 +34,7 @@ class TypeMeta(type):
 class BaseType(metaclass=TypeMeta):
     default_value = None
     default_sort = None
+    format_hints = None  # class that builds the format hints from a column
 
     def __init__(self):
         assert False
@@ -47,26 +48,62 @@ class BaseType(metaclass=TypeMeta):
         assert not choices
         return value
 
+    @classmethod
+    def get_formatter(cls, choices=None):
+        # a function that formats a whole column, anything that doesn't depend on
+        # the value is done up front rather than once per value
+        return partial(cls.format, choices=choices)
+
     @staticmethod
     def _parse(value):
         return value
 
+    @staticmethod
+    def _is_relative(value):
+        return False
+
+    @classmethod
+    def is_relative(cls, lookup, value):
+        # relative values like "now" parse differently every time
+        type_ = cls._lookup_types.get(lookup)
+        return type_ is not None and type_._is_relative(value)
+
     @classmethod
     def parse(cls, lookup, value):
-        lookups = cls.lookups
-        if lookup not in lookups:
-            return None, f"Bad lookup '{lookup}' expected {lookups}"
+        type_ = cls._lookup_types.get(lookup)
+        if type_ is None:
+            return None, f"Bad lookup '{lookup}' expected {dict(cls.lookups)}"
         else:
-            type_ = TYPES[lookups[lookup]]
             try:
                 return type_._parse(value), None
             except Exception as e:
                 err_message = str(e) if str(e) else repr(e)
                 return None, err_message
 
-    @staticmethod
-    def get_format_hints(name, data):
-        return {}
+    @classmethod
+    def get_format_hints(cls, name, data):
+        if cls.format_hints is None:
+            return {}
+        hints = cls.format_hints()
+        hints.add(row[name] for row in data if row)
+        return hints.get()
+
+
+class NumberFormatHints:
+    # built up a chunk of values at a time so results can be streamed
+    def __init__(self):
+        self._decimal_places = OptimalDecimalPlaces()
+
+    def add(self, values):
+        self._decimal_places.add(v for v in values if v and v > 0.0001)
+
+    def get(self):
+        return {
+            "decimalPlaces": self._decimal_places.value,
+            "significantFigures": 3,
+            "lowCutOff": 0.0001,
+            "highCutOff": 1e10,
+        }
 
 
 class StringType(BaseType):
@@ -92,10 +129,15 @@ class StringType(BaseType):
 class ChoiceTypeMixin:
     default_value = None
 
+    @classmethod
+    def format(cls, value, choices=None):
+        return cls.get_formatter(choices)(value)
+
     @staticmethod
-    def format(value, choices=None):
+    def get_formatter(choices=None):
         assert choices
-        return dict(choices)[value] if value is not None else None
+        choices = dict(choices)
+        return lambda value: choices[value] if value is not None else None
 
 
 class StringChoiceType(ChoiceTypeMixin, BaseType):
@@ -111,11 +153,20 @@ class StringChoiceType(ChoiceTypeMixin, BaseType):
 class ArrayTypeMixin:
     default_value = None
 
+    @classmethod
+    def format(cls, value, choices=None):  # pragma: postgres
+        return cls.get_formatter(choices)(value)
+
     @staticmethod
-    def format(value, choices=None):  # pragma: postgres
-        if choices:
-            value = [dict(choices)[v] if v is not None else None for v in value]
-        return ", ".join(str(v) for v in value)
+    def get_formatter(choices=None):  # pragma: postgres
+        choices = dict(choices) if choices else None
+
+        def format_(value):
+            if choices:
+                value = [choices[v] if v is not None else None for v in value]
+            return ", ".join(str(v) for v in value)
+
+        return format_
 
 
 class StringArrayType(ArrayTypeMixin, BaseType):
@@ -167,22 +218,16 @@ class NumberType(BaseType):
         assert not choices
         return float(value) if value is not None else None
 
+    @staticmethod
+    def get_formatter(choices=None):
+        assert not choices
+        return lambda value: float(value) if value is not None else None
+
     @staticmethod
     def _parse(value):
         return float(value)
 
-    @staticmethod
-    def get_format_hints(name, data):
-        # we add . here so there is always at least one .
-        nums = [
-            row[name] for row in data if row and row[name] and abs(row[name] > 0.0001)
-        ]
-        return {
-            "decimalPlaces": get_optimal_decimal_places(nums),
-            "significantFigures": 3,
-            "lowCutOff": 0.0001,
-            "highCutOff": 1e10,
-        }
+    format_hints = NumberFormatHints
 
 
 class NumberChoiceType(ChoiceTypeMixin, BaseType):
@@ -277,20 +322,33 @@ class DateTimeType(BaseType):
             "is_null": BooleanType,
         }
 
+    @staticmethod
+    def _is_relative(value):
+        return value.lower().strip() == "now"
+
     @staticmethod
     def _parse(value):
-        if value.lower().strip() == "now":
+        if DateTimeType._is_relative(value):
             return timezone.now()
         return timezone.make_aware(dateutil.parser.parse(value))
 
+    @classmethod
+    def format(cls, value, choices=None):
+        return cls.get_formatter(choices)(value)
+
     @staticmethod
-    def format(value, choices=None):
+    def get_formatter(choices=None):
         assert not choices
-        if value:
-            if not timezone.is_naive(value):
-                value = timezone.make_naive(value)
-            return str(value)
-        return None
+        tz = timezone.get_current_timezone()
+
+        def format_(value):
+            if value:
+                if not timezone.is_naive(value):
+                    value = timezone.make_naive(value, tz)
+                return str(value)
+            return None
+
+        return format_
 
 
 class DateType(BaseType):
@@ -309,23 +367,43 @@ class DateType(BaseType):
             "is_null": BooleanType,
         }
 
+    @staticmethod
+    def _is_relative(value):
+        return value.lower().strip() == "today"
+
     @staticmethod
     def _parse(value):
-        if value.lower().strip() == "today":
+        if DateType._is_relative(value):
             return timezone.now().date()
         return timezone.make_aware(dateutil.parser.parse(value)).date()
 
+    @classmethod
+    def format(cls, value, choices=None):
+        return cls.get_formatter(choices)(value)
+
     @staticmethod
-    def format(value, choices=None):
+    def get_formatter(choices=None):
         assert not choices
         # todo: custom format
-        if value is not None:
-            format = 'd.m.Y'
+        format = get_format("d.m.Y")
+        tz = timezone.get_current_timezone()
+        formatted = {}  # dates repeat a lot, only format each one once
+
+        def localize(value):
             if isinstance(value, datetime.datetime) and timezone.is_aware(value):
-                value = timezone.localtime(value)
-            return date_format(value, format)
-        return None
-        # return str(value) if value else None
+                return timezone.localtime(value, tz)
+            return value
+
+        def format_(value):
+            if value is not None:
+                res = formatted.get(value)
+                if res is None:
+                    res = formatted[value] = dateformat.format(localize(value), format)
+                return res
+            return None
+            # return str(value) if value else None
+
+        return format_
 
 
 class WeekDayType(BaseType):
@@ -478,3 +556,18 @@ class JSONType(BaseType):
 
 
 TYPES = {cls.name: cls for cls in all_subclasses(BaseType)}
+
+
+def _freeze_lookups():
+    # _lookups refers to types declared further down the module so the tables
+    # can only be built once they all exist, after that they are read only
+    for type_ in [BaseType, *TYPES.values()]:
+        lookup_types = type_._lookups()
+        type_._lookup_types = MappingProxyType(lookup_types)
+        type_._lookup_names = MappingProxyType(
+            {name: lookup_type.name for name, lookup_type in lookup_types.items()}
+        )
+        type_._default_lookup = next(iter(lookup_types), None)
+
+
+_freeze_lookups()
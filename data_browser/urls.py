@@ -7,7 +7,16 @@ from django.views.static import serve
 
 from .api import view_detail, view_list
 from .common import settings
-from .views import proxy_js_dev_server, query, query_ctx, query_html, view
+from .views import (
+    cancel,
+    proxy_js_dev_server,
+    query,
+    query_choices,
+    query_ctx,
+    query_fields,
+    query_html,
+    view,
+)
 
 FE_BUILD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fe_build")
 WEB_ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "web_root")
@@ -33,7 +42,10 @@ urlpatterns = [
     # queries
     path(f"{QUERY_PATH}.html", query_html, name="query_html"),
     path(f"{QUERY_PATH}.ctx", query_ctx),
+    path(f"{QUERY_PATH}.fields", query_fields, name="query_fields"),
+    path(f"{QUERY_PATH}.choices", query_choices, name="query_choices"),
     path(f"{QUERY_PATH}.<media>", query, name="query"),
+    path("cancel/<request_id>", cancel, name="cancel"),
     # views
     path("view/<pk>.<media>", view, name="view"),
     # api
@@ -1,30 +1,53 @@
 import cProfile
 import csv
+import gzip
+import hashlib
 import io
 import itertools
 import json
 import marshal
 import pstats
 import sys
+from functools import lru_cache
 
 import django.contrib.admin.views.decorators as admin_decorators
 import sqlparse
 from django import http
 from django.contrib.auth.decorators import login_required
 from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError
 from django.shortcuts import get_object_or_404
 from django.template import engines, loader
 from django.template.response import TemplateResponse
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
 from django.views.decorators import csrf
 
 from . import version
-from .common import HttpResponse, JsonResponse, can_make_public, settings
+from .common import (
+    HttpResponse,
+    JsonResponse,
+    LRUCache,
+    StreamingHttpResponse,
+    can_make_public,
+    settings,
+)
 from .models import View
-from .orm_admin import get_models
+from .orm_admin import get_models, get_schema_fingerprint
 from .orm_fields import OPEN_IN_ADMIN
-from .orm_results import get_result_queryset, get_results
+from .orm_results import (
+    QueryBudget,
+    Truncation,
+    cancel_query,
+    decode_cursor,
+    get_cached_results,
+    get_result_count,
+    get_result_queryset,
+    get_results,
+    iter_results_flat,
+)
 from .query import BoundQuery, Query
 from .types import TYPES
 
@@ -63,8 +86,11 @@ def _get_model_fields(orm_model):
         front = {"id": 1, OPEN_IN_ADMIN: 2}
         return sorted(fields, key=lambda f: (front.get(f, sys.maxsize), f))
 
-    all_fields = {
-        name: {
+    max_choices = settings.DATA_BROWSER_MAX_INLINE_CHOICES
+
+    all_fields = {}
+    for name, orm_field in orm_model.fields.items():
+        all_fields[name] = {
             "model": orm_field.rel_name,
             "type": orm_field.type_.name if orm_field.type_ else None,
             "concrete": orm_field.concrete,
@@ -72,8 +98,10 @@ def _get_model_fields(orm_model):
             "prettyName": orm_field.pretty_name,
             "choices": orm_field.choices,
         }
-        for name, orm_field in orm_model.fields.items()
-    }
+        if max_choices is not None and len(orm_field.choices) > max_choices:
+            # the rest are available from query_choices
+            all_fields[name]["choices"] = orm_field.choices[:max_choices]
+            all_fields[name]["moreChoices"] = True
 
     return {
         "fields": all_fields,
@@ -95,38 +123,182 @@ def _get_config(request):
         for name, type_ in TYPES.items()
     }
 
-    all_model_fields = {
-        model_name: _get_model_fields(orm_model)
-        for model_name, orm_model in orm_models.items()
-    }
+    if settings.DATA_BROWSER_LAZY_MODEL_FIELDS:
+        # just the type models, the frontend fetches the others from query_fields
+        all_model_fields = {name: _get_model_fields(orm_models[name]) for name in TYPES}
+        root_admins = orm_models.root_admins()
+        for name, admin in root_admins.items():
+            all_model_fields[name] = {
+                "defaultFilters": getattr(admin, "ddb_default_filters", "")
+            }
+        sorted_models = sorted(root_admins)
+    else:
+        all_model_fields = {
+            model_name: _get_model_fields(orm_model)
+            for model_name, orm_model in orm_models.items()
+        }
+        sorted_models = sorted(name for name, model in orm_models.items() if model.root)
 
     return {
         "baseUrl": reverse("data_browser:home"),
         "types": types,
         "allModelFields": all_model_fields,
-        "sortedModels": sorted(
-            name for name, model in orm_models.items() if model.root
-        ),
+        "sortedModels": sorted_models,
         "canMakePublic": can_make_public(request.user),
         "sentryDsn": settings.DATA_BROWSER_FE_DSN,
         "defaultRowLimit": settings.DATA_BROWSER_DEFAULT_ROW_LIMIT,
     }
 
 
+def _get_orm_field(orm_models, model_name, path):
+    orm_field = None
+    for part in path:
+        if model_name not in orm_models:
+            return None
+        orm_field = orm_models[model_name].fields.get(part)
+        if orm_field is None:
+            return None
+        model_name = orm_field.rel_name
+    return orm_field
+
+
+@login_required
+def query_fields(request, *, model_name, fields=""):
+    orm_models = get_models(request)
+    if model_name not in orm_models:
+        raise http.Http404(f"{model_name} does not exist")
+
+    data = json.dumps(_get_model_fields(orm_models[model_name]), cls=DjangoJSONEncoder)
+    etag = f'"{hashlib.sha1(data.encode()).hexdigest()}"'
+    if _not_modified(request, etag):
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(data, content_type="application/json")
+    return _set_etag(response, etag)
+
+
+@login_required
+def query_choices(request, *, model_name, fields):
+    orm_models = get_models(request)
+    orm_field = _get_orm_field(orm_models, model_name, fields.split("__"))
+    if orm_field is None:
+        raise http.Http404(f"{model_name}.{fields} does not exist")
+
+    search = request.GET.get("search", "").lower()
+    try:
+        offset = max(0, int(request.GET.get("offset", 0)))
+        limit = max(1, int(request.GET.get("limit", 100)))
+    except ValueError:
+        return HttpResponse("Bad offset or limit", status=400)
+
+    choices = [
+        (value, label) for value, label in orm_field.choices if search in label.lower()
+    ]
+    return JsonResponse(
+        {
+            "choices": choices[offset : offset + limit],
+            "more": len(choices) > offset + limit,
+        }
+    )
+
+
+class _SerializedConfig:
+    """The config json and its digest, the gzip and html encodings are made on
+    first use as each view only needs one of them. Instances live in the config
+    cache when the schema cache is on so the encodings are kept with them."""
+
+    def __init__(self, config):
+        self._config = config
+        self.json = config.encode()
+        self.digest = hashlib.sha1(self.json).hexdigest()
+        self._gzip = None
+        self._html = None
+
+    @property
+    def gzip(self):
+        if self._gzip is None:
+            self._gzip = gzip.compress(self.json)
+        return self._gzip
+
+    @property
+    def html(self):
+        if self._html is None:
+            self._html = self._config.translate(_HTML_ESCAPES)
+        return self._html
+
+
+_config_cache = LRUCache("DATA_BROWSER_SCHEMA_CACHE_SIZE")
+_HTML_ESCAPES = str.maketrans({"<": "\\u003C", ">": "\\u003E", "&": "\\u0026"})
+
+
+def _get_serialized_config(request):
+    key = (get_schema_fingerprint(request), reverse("data_browser:home"))
+    res = _config_cache.get(key)
+    if res is None:
+        res = _SerializedConfig(json.dumps(_get_config(request), cls=DjangoJSONEncoder))
+        _config_cache.set(key, res)
+    return res
+
+
+def _not_modified(request, etag):
+    return etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+
+
+def _set_etag(response, etag):
+    # the config is per user so the browser must always revalidate it
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def _accepts_gzip(request):
+    # a coding can be refused with q=0, and * covers everything not listed
+    qualities = {}
+    for item in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+
+@lru_cache(maxsize=None)
+def _get_template_digest():
+    # the template names the frontend bundles, which can change with the version
+    # staying the same in development builds
+    template = loader.get_template("data_browser/index.html")
+    return hashlib.sha1(template.template.source.encode()).hexdigest()
+
+
 @login_required
 def query_ctx(request, *, model_name="", fields=""):
-    config = _get_config(request)
-    return JsonResponse(config)
+    config = _get_serialized_config(request)
+    gzipped = _accepts_gzip(request)
+    etag = f'"{config.digest}-gzip"' if gzipped else f'"{config.digest}"'
+
+    if _not_modified(request, etag):
+        response = HttpResponse(status=304)
+    elif gzipped:
+        response = HttpResponse(config.gzip, content_type="application/json")
+        response["Content-Encoding"] = "gzip"
+    else:
+        response = HttpResponse(config.json, content_type="application/json")
+
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return _set_etag(response, etag)
 
 
 @csrf.ensure_csrf_cookie
 @login_required
 def query_html(request, *, model_name="", fields=""):
-    config = _get_config(request)
-    config = json.dumps(config, cls=DjangoJSONEncoder)
-    config = (
-        config.replace("<", "\\u003C").replace(">", "\\u003E").replace("&", "\\u0026")
-    )
+    config = _get_serialized_config(request)
+    etag = f'"{config.digest}-{version}-{_get_template_digest()}"'
 
     if settings.DATA_BROWSER_DEV:  # pragma: no cover
         try:
@@ -135,10 +307,13 @@ def query_html(request, *, model_name="", fields=""):
             return HttpResponse(f"Error loading from JS dev server.<br><br>{e}")
 
         template = engines["django"].from_string(response.text)
+    elif _not_modified(request, etag):
+        return _set_etag(HttpResponse(status=304), etag)
     else:
         template = loader.get_template("data_browser/index.html")
 
-    return TemplateResponse(request, template, {"config": config, "version": version})
+    context = {"config": config.html, "version": version}
+    return _set_etag(TemplateResponse(request, template, context), etag)
 
 
 @login_required
@@ -152,6 +327,14 @@ def query(request, *, model_name, fields="", media):
     return _data_response(request, query, media, privilaged=True, profiler=profiler)
 
 
+@login_required
+@csrf.csrf_protect
+def cancel(request, *, request_id):
+    if request.method != "POST":
+        return http.HttpResponseNotAllowed(["POST"])
+    return JsonResponse({"cancelled": cancel_query(request, request_id)})
+
+
 def view(request, pk, media):
     view = get_object_or_404(View.objects.filter(public=True), public_slug=pk)
     if (
@@ -199,14 +382,165 @@ def pad_table(x, table):
     return [pad(x) + row for row in table]
 
 
+class _Echo:
+    # a file like object that hands back what's written so csv.writer can stream
+    def write(self, value):
+        return value
+
+
+def _csv_rows_pivoted(bound_query, results):
+    # the pivoted column headers
+    yield from pad_table(
+        len(bound_query.row_fields) - 1,
+        flip_table(
+            format_table(
+                bound_query.col_fields,
+                results["cols"],
+                spacing=len(bound_query.data_fields) - 1,
+            )
+        ),
+    )
+
+    # the row headers and data area
+    yield from pad_table(
+        1 - len(bound_query.row_fields),
+        join_tables(
+            format_table(bound_query.row_fields, results["rows"]),
+            *(
+                format_table(bound_query.data_fields, sub_table)
+                for sub_table in results["body"]
+            ),
+        ),
+    )
+
+
+def _csv_rows_flat(request, bound_query, orm_models):
+    fields = bound_query.row_fields
+    yield [" ".join(f.pretty_path) for f in fields]
+    for chunk in iter_results_flat(request, bound_query, orm_models):
+        for row in chunk:
+            yield [row[f.path_str] for f in fields]
+
+
+def _json_flat(request, bound_query, orm_models, resp):
+    # the same document get_results + JsonResponse would produce, built as we go
+    encoder = DjangoJSONEncoder()
+    fields = bound_query.bound_row_fields
+    hints = {f.path_str: f.type_.format_hints() for f in fields if f.has_format_hints}
+
+    yield "{"
+    for key, value in resp.items():
+        yield f"{encoder.encode(key)}: {encoder.encode(value)}, "
+
+    yield '"rows": ['
+    length = 0
+    truncation = Truncation()
+    for chunk in iter_results_flat(request, bound_query, orm_models, truncation):
+        for row in chunk:
+            yield f"{', ' if length else ''}{encoder.encode(row)}"
+            length += 1
+        for path_str, field_hints in hints.items():
+            field_hints.add(row[path_str] for row in chunk)
+    yield "], "
+
+    format_hints = {f.path_str: {} for f in fields}
+    format_hints.update(
+        {name: field_hints.get() for name, field_hints in hints.items()}
+    )
+
+    yield f'"cols": {"[{}]" if length else "[]"}, '
+    yield f'"body": {encoder.encode([[{}] * length] if length else [])}, '
+    yield f'"length": {length}, '
+    yield f'"truncated": {encoder.encode(truncation.truncated)}, '
+    yield f'"next": {encoder.encode(truncation.next)}, '
+    yield f'"formatHints": {encoder.encode(format_hints)}'
+    yield "}"
+
+
+def _dictionary_key(value):
+    # keep 1, 1.0 and True apart and cope with unhashable json values
+    try:
+        hash(value)
+    except TypeError:
+        return list, json.dumps(value, cls=DjangoJSONEncoder)
+    return type(value), value
+
+
+def _dictionary_encode_column(column):
+    # returns the distinct values and per row codes, or None if there are so
+    # many distinct values that the codes would only add to the payload
+    keys = column
+    if len(set(map(type, column)) - {type(None)}) > 1:
+        keys = [_dictionary_key(value) for value in column]
+    try:
+        uniques = dict.fromkeys(keys)
+    except TypeError:  # a single unhashable type
+        keys = [_dictionary_key(value) for value in column]
+        uniques = dict.fromkeys(keys)
+
+    if len(uniques) * 2 > len(column):
+        return None
+    index = {key: i for i, key in enumerate(uniques)}
+    codes = [index[key] for key in keys]
+    if keys is column:
+        return list(index), codes
+    values = dict(zip(keys, column))
+    return [values[key] for key in index], codes
+
+
+def _dictionary_encode(fields, table):
+    values = {}
+    codes = {}
+    for field in fields:
+        name = field.path_str
+        column = [row[name] for row in table]
+        encoded = _dictionary_encode_column(column)
+        if encoded:
+            values[name], codes[name] = encoded
+        else:
+            values[name] = column
+    return {"count": len(table), "values": values, "codes": codes}
+
+
+def _columnar_table(fields, table):
+    names = [f.path_str for f in fields]
+    return {
+        "values": {
+            name: [row[name] if row else None for row in table] for name in names
+        },
+        "missing": [i for i, row in enumerate(table) if row is None],
+    }
+
+
+def _columnar_results(bound_query, results):
+    # one array per field instead of a dict per cell, headers are dictionary
+    # encoded as they repeat a lot, Results.js decodeResults undoes this
+    return {
+        **results,
+        "format": "columns",
+        "rows": _dictionary_encode(bound_query.row_fields, results["rows"]),
+        "cols": _dictionary_encode(bound_query.col_fields, results["cols"]),
+        "body": [
+            _columnar_table(bound_query.data_fields, table) for table in results["body"]
+        ],
+    }
+
+
 def _data_response(request, query, media, privilaged=False, profiler=None):
     orm_models = get_models(request)
     if query.model_name not in orm_models:
         raise http.Http404(f"{query.model_name} does not exist")
-    bound_query = BoundQuery.bind(query, orm_models)
+    bound_query = BoundQuery.bind(query, orm_models, get_schema_fingerprint(request))
+    if bound_query.after:
+        try:
+            decode_cursor(bound_query, bound_query.after)
+        except ValueError:
+            return HttpResponse("Bad cursor", status=400)
 
     if profiler:
         # get the results
+        request.data_browser_sql_plans = []
+        request.data_browser_value_cache = []
         results = get_results(request, bound_query, orm_models)
         resp = _get_query_data(bound_query) if privilaged else {}
         resp.update(results)
@@ -220,6 +554,17 @@ def _data_response(request, query, media, privilaged=False, profiler=None):
             stats = pstats.Stats(profiler, stream=buffer)
             stats.sort_stats("cumulative").print_stats(50)
             stats.sort_stats("time").print_stats(50)
+            for hit, compile_time in request.data_browser_sql_plans:
+                ms = f"{compile_time * 1000:.3f}ms"
+                if hit:
+                    print(f"SQL plan cache hit, looked up in {ms}", file=buffer)
+                else:
+                    print(f"SQL plan cache miss, compiled in {ms}", file=buffer)
+            for path_str, hits, misses in request.data_browser_value_cache:
+                print(
+                    f"Calculated value cache for {path_str}: {hits} hits, {misses} misses",
+                    file=buffer,
+                )
             buffer.seek(0)
             return HttpResponse(buffer, content_type="text/plain")
         elif media == "pstats":
@@ -233,50 +578,65 @@ def _data_response(request, query, media, privilaged=False, profiler=None):
             return response
         else:
             assert False
-    elif media == "csv":
-        results = get_results(request, bound_query, orm_models)
-        buffer = io.StringIO()
-        writer = csv.writer(buffer)
-
-        # the pivoted column headers
-        writer.writerows(
-            pad_table(
-                len(bound_query.row_fields) - 1,
-                flip_table(
-                    format_table(
-                        bound_query.col_fields,
-                        results["cols"],
-                        spacing=len(bound_query.data_fields) - 1,
-                    )
-                ),
-            )
+
+    budget = QueryBudget.for_request(request, orm_models[query.model_name].admin.model)
+    if budget is None:
+        return _media_response(
+            request, query, bound_query, orm_models, media, privilaged
         )
 
-        # the row headers and data area
-        writer.writerows(
-            pad_table(
-                1 - len(bound_query.row_fields),
-                join_tables(
-                    format_table(bound_query.row_fields, results["rows"]),
-                    *(
-                        format_table(bound_query.data_fields, sub_table)
-                        for sub_table in results["body"]
-                    ),
-                ),
+    request.data_browser_budget = budget
+    try:
+        with budget.applied():
+            return _media_response(
+                request, query, bound_query, orm_models, media, privilaged
             )
+    except DatabaseError as e:
+        error = budget.get_error(e)
+        if error is None:
+            raise
+        return JsonResponse({"error": error}, status=503)
+
+
+def _media_response(request, query, bound_query, orm_models, media, privilaged):
+    if media == "csv":
+        if bound_query.fields and not bound_query.col_fields:
+            # unpivoted results are streamed straight from the db cursor
+            rows = _csv_rows_flat(request, bound_query, orm_models)
+        else:
+            results = get_cached_results(request, bound_query, orm_models)
+            rows = _csv_rows_pivoted(bound_query, results)
+        writer = csv.writer(_Echo())
+        response = StreamingHttpResponse(
+            (writer.writerow(row) for row in rows), content_type="text/csv"
         )
-
-        buffer.seek(0)
-        response = HttpResponse(buffer, content_type="text/csv")
         response[
             "Content-Disposition"
         ] = f"attachment; filename={query.model_name}-{timezone.now().isoformat()}.csv"
         return response
     elif media == "json":
-        results = get_results(request, bound_query, orm_models)
         resp = _get_query_data(bound_query) if privilaged else {}
+        if (
+            bound_query.fields
+            and not bound_query.col_fields
+            and bound_query.limit > settings.DATA_BROWSER_STREAM_ROW_LIMIT
+        ):
+            # big unpivoted results are streamed straight from the db cursor
+            return StreamingHttpResponse(
+                _json_flat(request, bound_query, orm_models, resp),
+                content_type="application/json",
+            )
+        results = get_cached_results(request, bound_query, orm_models)
         resp.update(results)
         return JsonResponse(resp)
+    elif media == "columns":
+        results = get_cached_results(request, bound_query, orm_models)
+        resp = _get_query_data(bound_query) if privilaged else {}
+        resp.update(_columnar_results(bound_query, results))
+        return JsonResponse(resp)
+    elif media == "count":
+        count, approximate = get_result_count(request, bound_query, orm_models)
+        return JsonResponse({"count": count, "approximate": approximate})
     elif privilaged and media == "query":
         resp = _get_query_data(bound_query)
         return JsonResponse(resp)
@@ -11,7 +11,8 @@ import {
 import "./App.css";
 import { HomePage, QueryPage, LogoKS, EditSavedView } from "./Components";
 import { Query, getUrlForQuery, empty } from "./Query";
-import { doGet, fetchInProgress } from "./Util";
+import { decodeResults } from "./Results";
+import { doGet, fetchJson, fetchInProgress } from "./Util";
 
 const assert = require("assert");
 
@@ -26,8 +27,43 @@ class QueryApp extends React.Component {
       fields: [],
       filters: [],
       limit: props.config.defaultRowLimit,
+      allModelFields: props.config.allModelFields,
       ...empty,
     };
+    this.modelFieldRequests = {};
+  }
+
+  loadModelFields(model) {
+    // with DATA_BROWSER_LAZY_MODEL_FIELDS the config only carries stubs
+    // for the root models, their fields are fetched the first time we need them
+    const modelFields = this.state.allModelFields[model];
+    if (modelFields && modelFields.fields) return Promise.resolve(modelFields);
+    if (!this.modelFieldRequests[model]) {
+      const { baseUrl } = this.props.config;
+      const url = `${window.location.origin}${baseUrl}query/${model}/.fields`;
+      this.modelFieldRequests[model] = fetchJson(url).then((fields) => {
+        this.setState((state) => ({
+          allModelFields: { ...state.allModelFields, [model]: fields },
+        }));
+        return fields;
+      });
+    }
+    return this.modelFieldRequests[model];
+  }
+
+  loadModelsForPaths(model, paths) {
+    // load every model we walk through on the way to the given field paths
+    return this.loadModelFields(model).then((modelFields) =>
+      Promise.all(
+        paths
+          .filter((path) => path.length > 1)
+          .map((path) => {
+            const modelField = modelFields.fields[path[0]];
+            if (!modelField || !modelField.model) return null;
+            return this.loadModelsForPaths(modelField.model, [path.slice(1)]);
+          })
+      )
+    );
   }
 
   handleError(e) {
@@ -40,14 +76,18 @@ class QueryApp extends React.Component {
 
   fetchResults(state) {
     this.setState({ loading: true });
-    const url = getUrlForQuery(this.props.config.baseUrl, state, "json");
+    const { baseUrl } = this.props.config;
+    const url = getUrlForQuery(baseUrl, state, "columns");
 
-    return doGet(url).then((response) => {
+    return doGet(url, `${baseUrl}cancel/`).then((columns) => {
+      const response = decodeResults(columns);
       this.setState({
         body: response.body,
         cols: response.cols,
         rows: response.rows,
         length: response.length,
+        truncated: response.truncated,
+        next: response.next,
         formatHints: response.formatHints,
         filterErrors: response.filterErrors,
         loading: fetchInProgress,
@@ -57,6 +97,35 @@ class QueryApp extends React.Component {
     });
   }
 
+  loadMore() {
+    // fetch the page after the last row and append it, only unpivoted results
+    // have a next page so the rows and body tables just get longer
+    if (fetchInProgress) return; // the results are about to be replaced anyway
+    const { baseUrl } = this.props.config;
+    const url = getUrlForQuery(baseUrl, this.state, "columns");
+    const after = this.state.next;
+    this.setState({ loading: true });
+    return doGet(`${url}&after=${encodeURIComponent(after)}`, `${baseUrl}cancel/`)
+      .then((columns) => {
+        const response = decodeResults(columns);
+        this.setState((state) => {
+          // drop the page if the query changed while it was loading
+          const current = getUrlForQuery(baseUrl, state, "columns");
+          if (current !== url || state.next !== after)
+            return { loading: fetchInProgress };
+          return {
+            rows: [...state.rows, ...response.rows],
+            body: state.body.map((table, i) => [...table, ...response.body[i]]),
+            length: state.length + response.length,
+            truncated: response.truncated,
+            next: response.next,
+            loading: fetchInProgress,
+          };
+        });
+      })
+      .catch(this.handleError.bind(this));
+  }
+
   popstate(e) {
     this.setState(e.state);
     this.fetchResults(e.state).catch(this.handleError.bind(this));
@@ -66,26 +135,33 @@ class QueryApp extends React.Component {
   componentDidMount() {
     const { model, fieldStr, queryStr, config } = this.props;
     const url = `${config.baseUrl}query/${model}/${fieldStr}.query${queryStr}`;
-    doGet(url).then((response) => {
-      const reqState = {
-        booting: false,
-        loading: true,
-        error: undefined,
-        model: response.model,
-        fields: response.fields,
-        filters: response.filters,
-        limit: response.limit,
-        ...empty,
-      };
-      this.setState(reqState);
-      window.history.replaceState(
-        reqState,
-        null,
-        getUrlForQuery(this.props.config.baseUrl, reqState, "html")
-      );
-      window.addEventListener("popstate", this.popstate);
-      this.fetchResults(this.state).catch(this.handleError.bind(this));
-    });
+    doGet(url)
+      .then((response) =>
+        this.loadModelsForPaths(
+          response.model,
+          [...response.fields, ...response.filters].map((f) => f.path)
+        ).then(() => response)
+      )
+      .then((response) => {
+        const reqState = {
+          booting: false,
+          loading: true,
+          error: undefined,
+          model: response.model,
+          fields: response.fields,
+          filters: response.filters,
+          limit: response.limit,
+          ...empty,
+        };
+        this.setState(reqState);
+        window.history.replaceState(
+          reqState,
+          null,
+          getUrlForQuery(this.props.config.baseUrl, reqState, "html")
+        );
+        window.addEventListener("popstate", this.popstate);
+        this.fetchResults(this.state).catch(this.handleError.bind(this));
+      });
   }
 
   componentWillUnmount() {
@@ -121,16 +197,18 @@ class QueryApp extends React.Component {
   render() {
     if (this.state.booting) return "";
     const query = new Query(
-      this.props.config,
+      { ...this.props.config, allModelFields: this.state.allModelFields },
       this.state,
-      this.handleQueryChange.bind(this)
+      this.handleQueryChange.bind(this),
+      this.loadModelFields.bind(this)
     );
     return (
       <QueryPage
         query={query}
         sortedModels={this.props.config.sortedModels}
-        allModelFields={this.props.config.allModelFields}
+        allModelFields={this.state.allModelFields}
         baseUrl={this.props.config.baseUrl}
+        loadMore={this.loadMore.bind(this)}
         {...this.state}
       />
     );
@@ -1,14 +1,63 @@
 import React from "react";
 import { Link, useParams, useHistory } from "react-router-dom";
-import { TLink, SLink, useData, version, Save, Delete, CopyText } from "./Util";
+import {
+  TLink,
+  SLink,
+  useData,
+  version,
+  Save,
+  Delete,
+  CopyText,
+  fetchJson,
+} from "./Util";
 import { Results } from "./Results";
 import { getPartsForQuery } from "./Query";
 import logo from "./logo.png";
 import { validNames, invalidNames } from './fieldNames';
 import "./App.css";
 
+class ChoiceSearch extends React.Component {
+  constructor(props) {
+    super(props);
+    this.state = { choices: props.field.choices };
+  }
+
+  search(text) {
+    const { query, path } = this.props;
+    fetchJson(query.getUrlForChoices(path, text))
+      .then((response) => this.setState({ choices: response.choices }))
+      .catch((e) => console.log(e));
+  }
+
+  render() {
+    const { onChange, value, path } = this.props;
+    const listId = `choices-${path.join("__")}`;
+    return (
+      <>
+        <input
+          {...{ value }}
+          list={listId}
+          onChange={(e) => {
+            onChange(e.target.value);
+            this.search(e.target.value);
+          }}
+          className="FilterValue"
+          type="text"
+        />
+        <datalist id={listId}>
+          {this.state.choices.map(([option, label]) => (
+            <option key={option} value={option}>
+              {label}
+            </option>
+          ))}
+        </datalist>
+      </>
+    );
+  }
+}
+
 function FilterValue(props) {
-  const { lookup, onChange, value, field } = props;
+  const { lookup, onChange, value, field, query, path } = props;
   const onChangeEvent = (e) => onChange(e.target.value);
   if (props.lookup.type === "boolean")
     return (
@@ -54,6 +103,11 @@ function FilterValue(props) {
         ))}
       </select>
     );
+  else if (
+    field.moreChoices &&
+    (lookup.type === "numberchoice" || lookup.type === "stringchoice")
+  )
+    return <ChoiceSearch {...{ onChange, value, field, query, path }} />;
   else if (
     field.choices.length &&
     (lookup.type === "numberchoice" || lookup.type === "stringchoice")
@@ -200,7 +254,7 @@ class Filter extends React.Component {
         <td>=</td>
         <td>
           <FilterValue
-            {...{ value, field }}
+            {...{ value, field, query, path }}
             onChange={(val) => query.setFilterValue(index, val)}
             lookup={type.lookups[lookup]}
           />
@@ -246,6 +300,8 @@ class Field extends React.Component {
   }
 
   toggle() {
+    const { query, modelField } = this.props;
+    if (!this.state.toggled) query.loadModelFields(modelField.model);
     this.setState((state) => ({
       toggled: !state.toggled,
     }));
@@ -304,6 +360,7 @@ class Field extends React.Component {
 
 function AllFields(props) {
   const { query, model, path, prettyPath } = props;
+  if (!query.isModelLoaded(model)) return "Загрузка...";
   const modelFields = query.getModelFields(model);
   return (
     <table>
@@ -383,6 +440,26 @@ function LogoKS() {
   );
 }
 
+function RowCount(props) {
+  const { query } = props;
+  const url = query.getUrlForMedia("count");
+  const [count, setCount] = React.useState({ url: null });
+
+  if (count.url !== url)
+    return (
+      <TLink
+        onClick={() =>
+          fetchJson(url)
+            .then((response) => setCount({ url, ...response }))
+            .catch((e) => console.log(e))
+        }
+      >
+        (посчитать все)
+      </TLink>
+    );
+  return `из ${count.approximate ? "~" : ""}${count.count}`;
+}
+
 function QueryPage(props) {
   const {
     query,
@@ -390,6 +467,9 @@ function QueryPage(props) {
     cols,
     body,
     length,
+    truncated,
+    next,
+    loadMore,
     sortedModels,
     allModelFields,
     model,
@@ -408,7 +488,9 @@ function QueryPage(props) {
   let results;
   if (query.rowFields().length || query.colFields().length)
     results = (
-      <Results {...{ query, rows, cols, body, overlay, formatHints }} />
+      <Results
+        {...{ query, rows, cols, body, overlay, formatHints, next, loadMore }}
+      />
     );
   else results = <h2>Не выбраны поля</h2>;
 
@@ -417,7 +499,7 @@ function QueryPage(props) {
       <ModelSelector {...{ query, sortedModels, allModelFields, model }} />
       <Filters {...{ query, filters, filterErrors }} />
       <p>
-        <span className={length >= query.query.limit ? "Error" : ""}>
+        <span className={truncated ? "Error" : ""}>
           Ограничение:{" "}
           <input
             className="RowLimit"
@@ -428,7 +510,8 @@ function QueryPage(props) {
             }}
             min="1"
           />{" "}
-          - Показано {length} строк -{" "}
+          - Показано {length} строк{" "}
+          {truncated && <RowCount {...{ query }} />} -{" "}
         </span>
         <Save
           name="View"
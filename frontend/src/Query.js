@@ -3,6 +3,8 @@ const empty = {
   cols: [{}],
   body: [[{}]],
   length: 0,
+  truncated: false,
+  next: null,
   filterErrors: [],
   formatHints: {},
 };
@@ -32,10 +34,11 @@ function getUrlForQuery(baseUrl, query, media) {
 }
 
 class Query {
-  constructor(config, query, setQuery) {
+  constructor(config, query, setQuery, loadModelFields) {
     this.config = config;
     this.query = query;
     this.setQuery = setQuery;
+    this.loadModelFields = loadModelFields;
   }
 
   getField(path) {
@@ -55,6 +58,11 @@ class Query {
     return this.config.allModelFields[model];
   }
 
+  isModelLoaded(model) {
+    const modelFields = this.getModelFields(model);
+    return Boolean(modelFields && modelFields.fields);
+  }
+
   getDefaultLookupValue(field, type, lookup) {
     const lookup_type = type.lookups[lookup].type;
     if (lookup_type === "numberchoice" || lookup_type === "stringchoice")
@@ -181,6 +189,12 @@ class Query {
     return getUrlForQuery(this.config.baseUrl, this.query, media);
   }
 
+  getUrlForChoices(path, search) {
+    const basePath = `${this.config.baseUrl}query/${this.query.model}`;
+    const params = new URLSearchParams({ search: search });
+    return `${window.location.origin}${basePath}/${path.join("__")}.choices?${params}`;
+  }
+
   colFields() {
     return this.query.fields.filter((f) => f.pivoted);
   }
@@ -130,7 +130,8 @@ function HTableRow(props) {
 }
 
 function Results(props) {
-  const { query, cols, rows, body, overlay, formatHints } = props;
+  const { query, cols, rows, body, overlay, formatHints, next, loadMore } =
+    props;
   return (
     <div className="Results">
       <Overlay message={overlay} />
@@ -192,9 +193,60 @@ function Results(props) {
             ))}
           </tbody>
         </table>
+        {next && (
+          <p>
+            <TLink onClick={loadMore}>Загрузить ещё</TLink>
+          </p>
+        )}
       </div>
     </div>
   );
 }
 
-export { Results };
+function decodeHeaders(headers) {
+  const { count, values, codes } = headers;
+  const res = [];
+  for (let i = 0; i < count; i++) {
+    const row = {};
+    for (const pathStr in values) {
+      // columns without codes weren't worth dictionary encoding
+      const code = codes[pathStr] ? codes[pathStr][i] : i;
+      row[pathStr] = values[pathStr][code];
+    }
+    res.push(row);
+  }
+  return res;
+}
+
+function decodeTable(table, count) {
+  const { values, missing } = table;
+  const isMissing = new Set(missing);
+  const res = [];
+  for (let i = 0; i < count; i++) {
+    if (isMissing.has(i)) {
+      res.push(null);
+    } else {
+      const row = {};
+      for (const pathStr in values) {
+        row[pathStr] = values[pathStr][i];
+      }
+      res.push(row);
+    }
+  }
+  return res;
+}
+
+function decodeResults(response) {
+  // turn the "columns" format back into the per cell dicts the table renders
+  if (response.format !== "columns") return response;
+  const { format, ...rest } = response;
+  const rows = decodeHeaders(response.rows);
+  return {
+    ...rest,
+    rows: rows,
+    cols: decodeHeaders(response.cols),
+    body: response.body.map((table) => decodeTable(table, rows.length)),
+  };
+}
+
+export { Results, decodeResults };
@@ -5,6 +5,7 @@ import "./App.css";
 const assert = require("assert");
 let fetchInProgress = false;
 let nextFetch = undefined;
+let runningCancelUrl = undefined;
 
 const version = document.getElementById("backend-version").textContent.trim();
 
@@ -62,17 +63,37 @@ class AbortError extends Error {
     name = "AbortError";
 }
 
-function doFetch(url, options, process) {
+function cancelFetch(cancelUrl) {
+    // the server can't tell we've stopped waiting so ask it to stop the query
+    fetch(cancelUrl, {
+        method: "POST",
+        headers: { "X-CSRFToken": Cookies.get("csrftoken") },
+    }).catch(() => {});
+}
+
+function doFetch(url, options, process, cancelUrl) {
     if (fetchInProgress) {
         if (nextFetch) {
             nextFetch.reject(new AbortError("skipped"));
         }
+        if (runningCancelUrl) {
+            cancelFetch(runningCancelUrl);
+            runningCancelUrl = undefined;
+        }
         return new Promise((resolve, reject) => {
-            nextFetch = { resolve, reject, url, options, process };
+            nextFetch = { resolve, reject, url, options, process, cancelUrl };
         });
     }
 
     fetchInProgress = true;
+    if (cancelUrl) {
+        const requestId = Math.random().toString(36).slice(2);
+        options = {
+            ...options,
+            headers: { ...options.headers, "X-Request-Id": requestId },
+        };
+        runningCancelUrl = `${cancelUrl}${requestId}`;
+    }
 
     return fetch(url, options)
         .then((response) => {
@@ -80,9 +101,15 @@ function doFetch(url, options, process) {
             const next = nextFetch;
             nextFetch = undefined;
             fetchInProgress = false;
+            runningCancelUrl = undefined;
 
             if (next) {
-                doFetch(next.url, next.options, next.process).then(
+                doFetch(
+                    next.url,
+                    next.options,
+                    next.process,
+                    next.cancelUrl
+                ).then(
                     (res) => next.resolve(res),
                     (err) => next.reject(err)
                 );
@@ -113,8 +140,22 @@ function doFetch(url, options, process) {
         .then((response) => process(response)); // process data
 }
 
-function doGet(url) {
-    return doFetch(url, { method: "GET" }, (response) => response.json());
+function doGet(url, cancelUrl) {
+    return doFetch(
+        url,
+        { method: "GET" },
+        (response) => response.json(),
+        cancelUrl
+    );
+}
+
+function fetchJson(url) {
+    // for fetches that shouldn't cancel or be cancelled by the doFetch queue
+    return fetch(url, { method: "GET" }).then((response) => {
+        assert.ok(response.status >= 200);
+        assert.ok(response.status < 300);
+        return response.json();
+    });
 }
 
 function doDelete(url) {
@@ -294,6 +335,7 @@ export {
     SLink,
     doPatch,
     doGet,
+    fetchJson,
     doDelete,
     doPost,
     useData,
@@ -67,6 +67,7 @@ class TagAdmin(admin.ModelAdmin):
 class AddressAdmin(AdminMixin, admin.ModelAdmin):
     fields = ["pk", "city", "bob", "fred", "tom", "andrew", "producer"]
     readonly_fields = ["pk", "bob", "fred", "tom", "producer"]
+    ddb_calculated_fields_depend_on = {"bob": ["street"]}
 
     def bob(self, obj):
         assert obj.street != "bad", "err"
@@ -5138,10 +5138,12 @@ snapshots["test_query_json data"] = {
     "length": 2,
     "limit": 1000,
     "model": "core.Product",
+    "next": None,
     "rows": [
         {"name": "a", "size": 1.0, "size_unit": "g"},
         {"name": "b", "size": 1.0, "size_unit": "g"},
     ],
+    "truncated": False,
 }
 
 snapshots["test_query_json_pivot data"] = {
@@ -5210,5 +5212,7 @@ snapshots["test_query_json_pivot data"] = {
     "length": 3,
     "limit": 1000,
     "model": "core.Product",
+    "next": None,
     "rows": [{"created_time__year": 2020.0}, {"created_time__year": 2021.0}],
+    "truncated": False,
 }
@@ -1,4 +1,7 @@
 from django.contrib import admin
+from django.db.models import BooleanField, Value
+
+from data_browser.orm_admin import get_models
 
 from .core.admin import AddressAdmin, ProductAdmin
 from .core.models import Address, Producer, Product
@@ -64,3 +67,49 @@ class TestAnnotationOptimization:
         resp = AddressAdmin(Address, admin.site).changelist_view(request)
         assert resp.status_code == 200
         get_queryset.assert_called_once()
+
+
+class TestAnnotationOutputField:
+    def test_discovery_memoizes_output_field(self, rf, admin_user, mocker):
+        request = rf.get("/")
+        request.user = admin_user
+        get_models(request)["core.Product"]
+
+        get_queryset = mocker.patch(
+            "tests.core.admin.ProductAdmin.annotated.get_queryset",
+            wraps=ProductAdmin.annotated.get_queryset,
+        )
+        orm_models = get_models(request)
+        assert "annotated" in orm_models["core.Product"].fields
+        get_queryset.assert_not_called()
+
+    def test_boolean_from_output_field(self, admin_client):
+        assert admin_client.get("/admin/core/product/").status_code == 200
+        assert admin.site._registry[Product].annotated.boolean is False
+
+    def test_output_field_resolved_on_demand(self, rf, admin_user):
+        class FreshProductAdmin(ProductAdmin):
+            pass
+
+        request = rf.get("/")
+        request.user = admin_user
+        fresh_admin = FreshProductAdmin(Product, admin.site)
+        field = ProductAdmin.annotated.get_output_field(fresh_admin, request)
+        assert field is ProductAdmin.annotated.get_output_field(fresh_admin, request)
+        assert fresh_admin.annotated.boolean is False
+
+    def test_boolean_per_admin(self, admin_client):
+        class BooleanProductAdmin(ProductAdmin):
+            pass
+
+        product_admin = admin.site._registry[Product]
+        boolean_admin = BooleanProductAdmin(Product, admin.site)
+        qs = Product.objects.annotate(
+            annotated=Value(True, output_field=BooleanField())
+        )
+        ProductAdmin.annotated.resolve_output_field(boolean_admin, qs)
+
+        assert admin_client.get("/admin/core/product/").status_code == 200
+        assert boolean_admin.annotated.boolean is True
+        assert product_admin.annotated.boolean is False
+        assert ProductAdmin.annotated.boolean is False
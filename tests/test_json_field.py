@@ -2,7 +2,7 @@ import pytest
 from django.contrib import admin
 
 from data_browser.orm_admin import get_models
-from data_browser.orm_results import get_results
+from data_browser.orm_results import get_page_keys, get_results
 from data_browser.query import BoundQuery, Query
 
 from .conftest import JSON_FIELD_SUPPORT
@@ -103,3 +103,15 @@ def test_filter_has_key(get_results_flat):
     assert get_results_flat("json_field", {"json_field__has_key": ["hello"]}) == [
         {"json_field": '{"hello": "world"}'}
     ]
+
+
+def test_not_paged(req):
+    # json values can't be put in a cursor
+    admin.site.register(JsonModel, JsonAdmin)
+    try:
+        orm_models = get_models(req)
+        query = Query.from_request("json.JsonModel", "json_field", {})
+        bound_query = BoundQuery.bind(query, orm_models)
+    finally:
+        admin.site.unregister(JsonModel)
+    assert get_page_keys(bound_query) == []
@@ -1,17 +1,28 @@
+import base64
+import json
+import pickle
 from datetime import date, datetime, timedelta
 
 import django
 import pytest
+from django.apps import apps
+from django.contrib.admin import site
 from django.contrib.admin.options import BaseModelAdmin
 from django.contrib.auth.models import Permission, User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import transaction
 from django.utils import timezone
 
-from data_browser import orm_fields
+from data_browser import orm_admin, orm_fields, orm_results, version
+from data_browser.helpers import ddb_batch
 from data_browser.orm_admin import get_models
 from data_browser.orm_results import admin_get_queryset, get_results
 from data_browser.query import BoundQuery, Query
+from data_browser.types import NumberType, YearType
 
 from .core import models
+from .core.admin import AddressAdmin
 from .util import ANY, KEYS
 
 
@@ -201,6 +212,197 @@ def test_get_calculated_field_on_admin(get_product_flat):
     sortedAssert(data, [[None], ["err"], ["bob"]])
 
 
+@pytest.mark.usefixtures("products")
+@pytest.mark.parametrize(
+    "fields,deferred",
+    [
+        ("producer__address__bob", True),
+        ("producer__address__bob,producer__address__fred", False),
+    ],
+)
+def test_get_calculated_field_depends_on(
+    req, orm_models, django_assert_num_queries, fields, deferred
+):
+    query = Query.from_request("core.Product", fields, {})
+    bound_query = BoundQuery.bind(query, orm_models)
+    with django_assert_num_queries(2) as captured:
+        data = get_results(req, bound_query, orm_models)
+    assert {row["producer__address__bob"] for row in data["rows"]} == {
+        None,
+        "err",
+        "bob",
+    }
+
+    sql = captured.captured_queries[1]["sql"]
+    assert '"core_address"."street"' in sql
+    assert ('"core_address"."city"' not in sql) == deferred
+
+
+@pytest.mark.usefixtures("products")
+def test_get_calculated_field_batch(get_product_flat, mocker):
+    def bob(self, objs):
+        calls.append(len(objs))
+        return {obj.pk: obj.street for obj in objs}
+
+    calls = []
+    mocker.patch.object(AddressAdmin, "bob", ddb_batch(bob))
+    data = get_product_flat(2, "producer__address__bob", {})
+    sortedAssert(data, [[None], ["bad"], ["good"]])
+    assert calls == [2]
+
+    assert AddressAdmin.bob(None, models.Address(street="single")) == "single"
+
+
+@pytest.mark.usefixtures("products")
+def test_get_calculated_field_batch_error(get_product_flat, mocker):
+    def bob(self, objs):
+        raise Exception("err")
+
+    mocker.patch.object(AddressAdmin, "bob", ddb_batch(bob))
+    data = get_product_flat(2, "producer__address__bob", {})
+    sortedAssert(data, [[None], ["err"], ["err"]])
+
+
+@pytest.fixture
+def cached_bob(mocker):
+    mocker.patch.object(
+        AddressAdmin, "ddb_calculated_fields_cache", {"bob": 60}, create=True
+    )
+    orm_results._get_versioned_models.cache_clear()
+    caches["default"].clear()
+    calls = []
+    bob = AddressAdmin.bob
+
+    def counted(self, obj):
+        calls.append(obj)
+        return bob(self, obj)
+
+    mocker.patch.object(AddressAdmin, "bob", counted)
+    yield calls
+    orm_results._get_versioned_models.cache_clear()
+
+
+# writes only invalidate the caches when they commit
+@pytest.mark.usefixtures("transactional_db", "products")
+def test_get_calculated_field_cached(get_product_flat, cached_bob):
+    before = orm_results.value_cache_info()
+    data = get_product_flat(2, "producer__address__bob", {})
+    sortedAssert(data, [[None], ["err"], ["bob"]])
+    assert len(cached_bob) == 2
+
+    # errors aren't cached
+    data = get_product_flat(2, "producer__address__bob", {})
+    sortedAssert(data, [[None], ["err"], ["bob"]])
+    assert len(cached_bob) == 3
+
+    after = orm_results.value_cache_info()
+    assert after["hits"] - before["hits"] == 1
+    assert after["misses"] - before["misses"] == 3
+
+    # saving any address throws them all away
+    models.Address.objects.create(street="bad")
+    get_product_flat(2, "producer__address__bob", {})
+    assert len(cached_bob) == 5
+
+
+@pytest.mark.usefixtures("transactional_db", "products")
+def test_get_calculated_field_cached_on_commit(get_product_flat, cached_bob):
+    get_product_flat(2, "producer__address__bob", {})
+    calls = len(cached_bob)
+
+    # a write only throws the values away once it commits, only the err is redone
+    with transaction.atomic():
+        models.Address.objects.create(street="bad")
+        get_product_flat(2, "producer__address__bob", {})
+        assert len(cached_bob) == calls + 1
+    get_product_flat(2, "producer__address__bob", {})
+    assert len(cached_bob) == calls + 3
+
+
+@pytest.mark.usefixtures("products")
+def test_get_calculated_field_cached_versioned(get_product_flat, cached_bob, mocker):
+    mocker.patch.object(
+        AddressAdmin, "ddb_calculated_fields_version", "city", create=True
+    )
+    orm_results._get_versioned_models.cache_clear()
+    get_product_flat(2, "producer__address__bob", {})
+    assert len(cached_bob) == 2
+
+    # saving doesn't matter, changing the version does
+    models.Address.objects.create(street="bad")
+    get_product_flat(2, "producer__address__bob", {})
+    assert len(cached_bob) == 3
+    models.Address.objects.filter(street="good").update(city="paris")
+    get_product_flat(2, "producer__address__bob", {})
+    assert len(cached_bob) == 5
+
+
+def test_get_dependencies():
+    assert orm_results._get_dependencies(
+        models.Product,
+        [
+            "name",
+            "producer__address__city",
+            "tags__name",
+            "producer__product__size",
+            "producer__product__producer__address",
+            "default_sku",
+        ],
+    ) == (
+        {"name", "producer", "producer__address__city", "default_sku"},
+        {"producer", "producer__address", "default_sku"},
+        {
+            "tags",
+            "producer__product_set",
+            "producer__product_set__producer",
+            "producer__product_set__producer__address",
+        },
+    )
+
+
+@pytest.fixture
+def frank_depends(mocker):
+    from .core.admin import ProducerAdmin
+
+    def frank(self, obj):
+        city = obj.address.city if obj.address else None
+        tags = sorted(t.name for p in obj.product_set.all() for t in p.tags.all())
+        names = [p.name for p in obj.product_set.all()]
+        return f"{city} {','.join(names)} {','.join(tags)}"
+
+    mocker.patch.object(ProducerAdmin, "frank", frank)
+    mocker.patch.object(
+        ProducerAdmin,
+        "ddb_calculated_fields_depend_on",
+        {"frank": ["address__city", "product__name", "product__tags__name"]},
+        create=True,
+    )
+    return ProducerAdmin
+
+
+@pytest.mark.usefixtures("products")
+@pytest.mark.parametrize(
+    "get_queryset,queries",
+    [
+        (lambda qs: qs, 4),  # joins the fk, prefetches the reverse fk and the m2m
+        (lambda qs: qs.select_related(), 13),  # can't tell, loads it all as before
+        (lambda qs: qs.select_related("address"), 4),
+        (lambda qs: qs.prefetch_related("address"), 4),
+        (lambda qs: qs.prefetch_related("product_set"), 4),
+    ],
+)
+def test_get_calculated_field_depends(
+    get_product_flat, frank_depends, mocker, get_queryset, queries
+):
+    tag = models.Tag.objects.create(name="x")
+    models.Product.objects.get(name="a").tags.add(tag)
+    qs = models.Producer.objects.all()
+    mocker.patch.object(frank_depends, "get_queryset", return_value=get_queryset(qs))
+
+    data = get_product_flat(queries, "name+1,producer__frank", {})
+    assert data == [["a", "london a x"], ["b", "london b "], ["c", "None c "]]
+
+
 def test_get_annotated_field_at_base(products, get_product_flat, mocker):
     mock = mocker.patch(
         "data_browser.orm_results.admin_get_queryset", wraps=admin_get_queryset
@@ -235,6 +437,20 @@ def test_get_calculated_field(get_product_flat):
     sortedAssert(data, [[None], ["bad"], ["fred"]])
 
 
+@pytest.mark.usefixtures("products")
+def test_iter_results_flat(req, orm_models, settings, django_assert_num_queries):
+    settings.DATA_BROWSER_CHUNK_SIZE = 2
+    query = Query.from_request("core.Product", "name+1,producer__address__fred", {})
+    bound_query = BoundQuery.bind(query, orm_models)
+    # one for the results plus one per chunk for the calculated field objects
+    with django_assert_num_queries(3):
+        chunks = list(orm_results.iter_results_flat(req, bound_query, orm_models))
+    assert [[flatten_table(bound_query.fields, chunk)] for chunk in chunks] == [
+        [[["a", "bad"], ["b", "fred"]]],
+        [[["c", None]]],
+    ]
+
+
 @pytest.mark.usefixtures("products")
 def test_get_property(get_product_flat):
     data = get_product_flat(2, "producer__address__tom", {})
@@ -455,7 +671,7 @@ def test_get_results_admin_causes_query(get_product_flat, products):
 @pytest.mark.usefixtures("pivot_products")
 def test_get_pivot(get_product_pivot):
     data = get_product_pivot(
-        3, "created_time__year+0,&created_time__month+1,id__count", {}
+        1, "created_time__year+0,&created_time__month+1,id__count", {}
     )
     assert data == {
         "body": [[[1], [3]], [[2], [4]]],
@@ -464,10 +680,57 @@ def test_get_pivot(get_product_pivot):
     }
 
 
+@pytest.mark.usefixtures("pivot_products")
+def test_get_pivot_truncated(get_product_pivot):
+    # the header order has to come from the sub queries when we hit the limit
+    data = get_product_pivot(
+        3,
+        "created_time__year+0,&created_time__month+1,id__count",
+        {"limit": ["3"]},
+    )
+    assert data == {
+        "body": [[[1], [3]], [[2], [None]]],
+        "cols": [["January"], ["Feburary"]],
+        "rows": [[2020], [2021]],
+    }
+
+
+@pytest.mark.usefixtures("transactional_db", "pivot_products")
+def test_get_pivot_workers(get_product_pivot, settings, mocker):
+    # workers use their own connections so the data has to be committed
+    settings.DATA_BROWSER_PIVOT_WORKERS = 2
+    run_in_worker = mocker.spy(orm_results, "_run_in_worker")
+    data = get_product_pivot(
+        2,  # the third is on a worker thread
+        "created_time__year+0,&created_time__month+1,id__count",
+        {"limit": ["3"]},
+    )
+    assert data == {
+        "body": [[[1], [3]], [[2], [None]]],
+        "cols": [["January"], ["Feburary"]],
+        "rows": [[2020], [2021]],
+    }
+    assert run_in_worker.call_count == 1
+
+
+@pytest.mark.usefixtures("transactional_db", "pivot_products")
+def test_get_pivot_workers_budget(req, get_product_pivot, settings, mocker):
+    # the worker queries are held to the requests budget too
+    settings.DATA_BROWSER_PIVOT_WORKERS = 2
+    settings.DATA_BROWSER_QUERY_TIMEOUT = 10
+    req.data_browser_budget = orm_results.QueryBudget(req, "default")
+    applied = mocker.spy(orm_results.QueryBudget, "applied")
+    data = get_product_pivot(
+        2, "created_time__year+0,&created_time__month+1,id__count", {"limit": ["3"]}
+    )
+    assert data["rows"] == [[2020], [2021]]
+    assert applied.call_count == 1
+
+
 @pytest.mark.usefixtures("pivot_products")
 def test_get_pivot_multi_agg(get_product_pivot):
     data = get_product_pivot(
-        3, "created_time__year+0,&created_time__month+1,size__count,size__max", {}
+        1, "created_time__year+0,&created_time__month+1,size__count,size__max", {}
     )
     assert data == {
         "body": [[[1, 1], [3, 6]], [[2, 3], [4, 10]]],
@@ -509,7 +772,7 @@ def test_pivot_sorting_with_empty_cell(get_product_pivot):
         models.Product.objects.create(created_time=dt, name=str(dt), producer=producer)
 
     data = get_product_pivot(
-        3, "&created_time__year+1,created_time__month+2,id__count", {}
+        1, "&created_time__year+1,created_time__month+2,id__count", {}
     )
     assert data == {
         "body": [[[None], [1]], [[2], [3]]],
@@ -518,7 +781,7 @@ def test_pivot_sorting_with_empty_cell(get_product_pivot):
     }
 
     data = get_product_pivot(
-        3, "&created_time__year+2,created_time__month+1,id__count", {}
+        1, "&created_time__year+2,created_time__month+1,id__count", {}
     )
     assert data == {
         "body": [[[None], [1]], [[2], [3]]],
@@ -547,7 +810,7 @@ def test_pivot_sorting_body(get_product_pivot):
         models.Product.objects.create(created_time=dt, name=str(dt), producer=producer)
 
     data = get_product_pivot(
-        3, "&created_time__year+1,created_time__month+3,id__count+2", {}
+        2, "&created_time__year+1,created_time__month+3,id__count+2", {}
     )
     assert data == {
         "body": [[[1], [3]], [[4], [3]]],
@@ -556,7 +819,7 @@ def test_pivot_sorting_body(get_product_pivot):
     }
 
     data = get_product_pivot(
-        3, "&created_time__year+1,created_time__month+3,id__count-2", {}
+        2, "&created_time__year+1,created_time__month+3,id__count-2", {}
     )
     assert data == {
         "body": [[[3], [1]], [[3], [4]]],
@@ -568,7 +831,7 @@ def test_pivot_sorting_body(get_product_pivot):
 @pytest.mark.usefixtures("pivot_products")
 def test_pivot_having(get_product_pivot):
     data = get_product_pivot(
-        3,
+        1,
         "&created_time__year,created_time__month,id__count",
         {"id__count__equals": [4]},
     )
@@ -613,8 +876,6 @@ def test_get_pivot_permutations(get_product_pivot, key, rows, cols, body):
         filters["id__equals"] = ["-1"]
 
     queries = 0 if key.endswith("---") else 1
-    if "r" in key and "c" in key:
-        queries += 2
 
     results = get_product_pivot(queries, ",".join(fields), filters)
     assert results["rows"] == rows
@@ -635,6 +896,160 @@ def test_get_fields(orm_models):
     assert "admin" not in orm_models["core.InlineAdmin"].fields
 
 
+def test_get_models_is_lazy(req, mocker):
+    get_fields_for_model = mocker.spy(orm_admin, "_get_fields_for_model")
+    orm_models = get_models(req)
+    assert "core.Product" in orm_models
+    assert "number" in orm_models
+    get_fields_for_model.assert_not_called()
+
+    query = Query.from_request("core.Product", "name,producer__name", {})
+    BoundQuery.bind(query, orm_models)
+    built = {call.args[1] for call in get_fields_for_model.call_args_list}
+    assert built == {models.Product, models.Producer}
+
+    assert "core.Product__missing" not in orm_models
+    assert "core.Missing" not in orm_models
+    assert len(orm_models) == len(dict(orm_models))
+
+
+def test_type_models_are_shared(req, rf, admin_user):
+    other = rf.get("/")
+    other.user = admin_user
+    orm_models = get_models(req)
+    other_models = get_models(other)
+    assert orm_models["number"] is other_models["number"]
+    with pytest.raises(TypeError):
+        orm_models["number"].fields["sum"] = None
+
+
+def test_type_lookups_are_frozen():
+    assert NumberType.lookups is NumberType.lookups
+    assert YearType.default_lookup == "equals"
+    assert YearType.parse("gt", "2000") == (2000, None)
+    assert YearType.parse("bob", "2000")[1].startswith("Bad lookup 'bob'")
+    with pytest.raises(TypeError):
+        NumberType.lookups["bob"] = "number"
+
+
+class TestSchemaSnapshot:
+    @pytest.fixture(autouse=True)
+    def static_schema(self, monkeypatch):
+        monkeypatch.setattr(orm_admin, "_static_schema", {})
+
+    def describe(self, orm_models):
+        return {
+            model_name: {
+                name: (f.type_, f.rel_name, str(f.pretty_name), f.choices)
+                for name, f in orm_model.fields.items()
+            }
+            for model_name, orm_model in orm_models.items()
+        }
+
+    def test_round_trip(self, req, tmp_path, mocker):
+        path = tmp_path / "schema.pickle"
+        call_command("ddb_schema_snapshot", str(path))
+        expected = self.describe(get_models(req))
+
+        orm_admin._static_schema.clear()
+        get_static_field = mocker.spy(orm_admin, "_get_static_field")
+        assert orm_admin.load_schema_snapshot(path)
+        assert self.describe(get_models(req)) == expected
+        get_static_field.assert_not_called()
+
+    def test_wrong_version(self, tmp_path):
+        path = tmp_path / "schema.pickle"
+        path.write_bytes(pickle.dumps({"version": "0.0.0", "models": {"a": {}}}))
+        assert not orm_admin.load_schema_snapshot(path)
+        assert orm_admin._static_schema == {}
+
+    def test_different_models(self, tmp_path, mocker):
+        path = tmp_path / "schema.pickle"
+        orm_admin.write_schema_snapshot(path)
+        orm_admin._static_schema.clear()
+
+        mocker.patch.object(orm_admin, "get_schema_digest", return_value="other")
+        assert not orm_admin.load_schema_snapshot(path)
+        assert orm_admin._static_schema == {}
+
+    def test_missing_field(self, tmp_path):
+        path = tmp_path / "schema.pickle"
+        snapshot = orm_admin.build_schema_snapshot()
+        del snapshot["models"]["core.Product"]["size"]
+        path.write_bytes(pickle.dumps(snapshot))
+        orm_admin._static_schema.clear()
+
+        assert not orm_admin.load_schema_snapshot(path)
+        assert orm_admin._static_schema == {}
+
+    def test_digest_covers_migrations(self, mocker):
+        digest = orm_admin.get_schema_digest()
+        assert orm_admin.get_schema_digest() == digest
+        mocker.patch.object(
+            orm_admin, "_get_migration_names", return_value=["0001_initial"]
+        )
+        assert orm_admin.get_schema_digest() != digest
+
+    @pytest.mark.parametrize(
+        "content",
+        [
+            b"",
+            pickle.dumps({"version": version, "models": {}})[:-3],
+            b"cnowhere\nThing\n.",
+            b"cdata_browser\nNothing\n.",
+            b"not a pickle",
+        ],
+    )
+    def test_unreadable(self, tmp_path, settings, content):
+        path = tmp_path / "schema.pickle"
+        path.write_bytes(content)
+        assert not orm_admin.load_schema_snapshot(path)
+
+        # and the site still starts
+        settings.DATA_BROWSER_SCHEMA_SNAPSHOT = str(path)
+        apps.get_app_config("data_browser").ready()
+        assert orm_admin._static_schema == {}
+
+    def test_write_replaces_atomically(self, tmp_path, mocker):
+        path = tmp_path / "schema.pickle"
+        orm_admin.write_schema_snapshot(path)
+        before = path.read_bytes()
+
+        mocker.patch.object(orm_admin.pickle, "dump", side_effect=OSError("full"))
+        with pytest.raises(OSError):
+            orm_admin.write_schema_snapshot(path)
+        assert path.read_bytes() == before
+        assert [p.name for p in tmp_path.iterdir()] == ["schema.pickle"]
+
+    def test_missing(self, tmp_path):
+        assert not orm_admin.load_schema_snapshot(tmp_path / "schema.pickle")
+
+    def test_command_needs_path(self):
+        with pytest.raises(CommandError):
+            call_command("ddb_schema_snapshot")
+
+    def test_command_default_path(self, tmp_path, settings):
+        settings.DATA_BROWSER_SCHEMA_SNAPSHOT = str(tmp_path / "schema.pickle")
+        call_command("ddb_schema_snapshot")
+        assert orm_admin.load_schema_snapshot(settings.DATA_BROWSER_SCHEMA_SNAPSHOT)
+
+    def test_ready_loads_snapshot(self, tmp_path, settings):
+        path = tmp_path / "schema.pickle"
+        call_command("ddb_schema_snapshot", str(path))
+        orm_admin._static_schema.clear()
+
+        settings.DATA_BROWSER_SCHEMA_SNAPSHOT = str(path)
+        apps.get_app_config("data_browser").ready()
+        assert "core.Product" in orm_admin._static_schema
+
+    def test_ready_doesnt_write(self, tmp_path, settings):
+        path = tmp_path / "schema.pickle"
+        settings.DATA_BROWSER_SCHEMA_SNAPSHOT = str(path)
+        apps.get_app_config("data_browser").ready()
+        assert not path.exists()
+        assert orm_admin._static_schema == {}
+
+
 class TestPermissions:
     def get_fields_with_perms(self, rf, perms):
         user = User.objects.create()
@@ -698,6 +1113,188 @@ class TestPermissions:
         )
 
 
+class TestSqlCache:
+    @pytest.fixture(autouse=True)
+    def sql_cache(self, settings):
+        settings.DATA_BROWSER_SQL_CACHE_SIZE = 10
+        orm_results._sql_cache.clear()
+
+    @pytest.mark.usefixtures("products")
+    def test_flat(self, get_product_flat, mocker, settings):
+        args = ("created_time__date+1,size,producer__name,boat__sum", {})
+        settings.DATA_BROWSER_SQL_CACHE_SIZE = 0
+        uncached = get_product_flat(1, *args)
+        settings.DATA_BROWSER_SQL_CACHE_SIZE = 10
+        get_rows_queryset = mocker.spy(orm_results, "_get_rows_queryset")
+        first = get_product_flat(1, *args)
+        second = get_product_flat(1, *args)
+        assert first == second == uncached
+        assert get_rows_queryset.call_count == 1
+
+    @pytest.mark.usefixtures("pivot_products")
+    def test_pivot(self, get_product_pivot):
+        args = ("created_time__year+0,&created_time__month+1,id__count", {})
+        first = get_product_pivot(1, *args)
+        hits = orm_results.sql_cache_info()["hits"]
+        assert get_product_pivot(1, *args) == first
+        assert orm_results.sql_cache_info()["hits"] == hits + 1
+
+    @pytest.mark.usefixtures("products")
+    def test_relative_filters_not_cached(self, get_product_flat):
+        filters = {"created_time__lt": ["now"]}
+        assert get_product_flat(1, "name+1", filters) == [["a"], ["b"], ["c"]]
+        assert get_product_flat(1, "name+1", filters) == [["a"], ["b"], ["c"]]
+        assert orm_results.sql_cache_info()["size"] == 0
+
+    @pytest.mark.usefixtures("products")
+    def test_keyed_on_filter_values(self, get_product_flat):
+        assert get_product_flat(1, "name+1", {"size__equals": ["1"]}) == [["a"], ["b"]]
+        assert get_product_flat(1, "name+1", {"size__equals": ["2"]}) == [["c"]]
+
+    @pytest.mark.usefixtures("products")
+    def test_aggregate_only_not_cached(self, get_product_flat):
+        assert get_product_flat(1, "size__sum", {}) == [[4]]
+        assert get_product_flat(1, "size__sum", {}) == [[4]]
+        assert orm_results.sql_cache_info()["size"] == 0
+
+    @pytest.mark.usefixtures("products")
+    def test_empty_result_set(self, get_product_flat):
+        # nothing sorts after a null in descending order, the sql can't be built
+        after = base64.urlsafe_b64encode(json.dumps([["date"], [None]]).encode())
+        filters = {"after": [after.decode()]}
+        assert get_product_flat(0, "date-0", filters) == []
+        hits = orm_results.sql_cache_info()["hits"]
+        assert get_product_flat(0, "date-0", filters) == []
+        assert orm_results.sql_cache_info()["hits"] == hits + 1
+
+    @pytest.mark.usefixtures("products")
+    def test_plans(self, req, get_product_flat):
+        req.data_browser_sql_plans = []
+        get_product_flat(1, "name+1", {})
+        get_product_flat(1, "name+1", {})
+        (miss, compile_time), (hit, lookup_time) = req.data_browser_sql_plans
+        assert (miss, hit) == (False, True)
+        (compiled,) = orm_results._sql_cache._data.values()
+        assert compile_time == compiled.compile_time != lookup_time
+
+
+def test_get_models_asks_reached_admins(req, settings, mocker):
+    # without the schema cache only the admins a query reaches are consulted
+    settings.DATA_BROWSER_SCHEMA_CACHE_SIZE = 0
+    normal_admin = site._registry[models.Normal]
+    has_change_permission = mocker.spy(normal_admin, "has_change_permission")
+    get_fieldsets = mocker.spy(normal_admin, "get_fieldsets")
+
+    orm_models = get_models(req)
+    query = Query.from_request("core.Product", "name,producer__address__city", {})
+    bound_query = BoundQuery.bind(query, orm_models)
+    assert [f.path_str for f in bound_query.fields] == [
+        "name",
+        "producer__address__city",
+    ]
+    assert has_change_permission.call_count == get_fieldsets.call_count == 0
+
+    assert "core.Normal" in orm_models
+    assert has_change_permission.call_count == 1
+    assert get_fieldsets.call_count == 1
+    assert "core.Normal" in orm_models
+    assert has_change_permission.call_count == get_fieldsets.call_count == 1
+
+    assert "core.NotInAdmin" not in orm_models
+    with pytest.raises(KeyError):
+        orm_models["core.NotInAdmin"]
+    with pytest.raises(KeyError):
+        orm_admin._AdminFields(req)[models.NotInAdmin]
+
+
+class TestSchemaCache:
+    @pytest.fixture
+    def schema_cache(self, settings):
+        settings.DATA_BROWSER_SCHEMA_CACHE_SIZE = 2
+        orm_admin.invalidate_schema_cache()
+        yield orm_admin._schema_cache
+        orm_admin.invalidate_schema_cache()
+
+    def make_request(self, rf, perms):
+        user = User.objects.create(username=str(User.objects.count()))
+        for perm in perms:
+            user.user_permissions.add(Permission.objects.get(codename=f"change_{perm}"))
+        request = rf.get("/")
+        request.user = user
+        return request
+
+    def test_disabled_by_default(self, req):
+        assert get_models(req) is not get_models(req)
+
+    def test_hit(self, req, schema_cache):
+        assert get_models(req) is get_models(req)
+        assert orm_admin.schema_cache_info() == {
+            "hits": 1,
+            "misses": 1,
+            "size": 1,
+            "maxsize": 2,
+        }
+
+    @pytest.mark.django_db
+    def test_keyed_on_permissions(self, rf, schema_cache):
+        normal = get_models(self.make_request(rf, ["normal"]))
+        assert get_models(self.make_request(rf, ["normal"])) is normal
+        other = get_models(self.make_request(rf, ["normal", "inadmin"]))
+        assert other is not normal
+        assert "core.InAdmin" in other
+        assert "core.InAdmin" not in normal
+
+    @pytest.mark.django_db
+    def test_eviction(self, rf, schema_cache):
+        first = get_models(self.make_request(rf, ["normal"]))
+        get_models(self.make_request(rf, ["inadmin"]))
+        get_models(self.make_request(rf, ["tag"]))
+        assert schema_cache.info()["size"] == 2
+        assert get_models(self.make_request(rf, ["normal"])) is not first
+
+    def test_built_before_caching(self, req, schema_cache, mocker):
+        models = get_models(req)
+        assert models._request is None
+
+        # later requests don't build anything with the request that cached it
+        get_fields_for_model = mocker.spy(orm_admin, "_get_fields_for_model")
+        assert dict(get_models(req)) == dict(models)
+        get_fields_for_model.assert_not_called()
+
+    def test_invalidate(self, req, schema_cache):
+        first = get_models(req)
+        orm_admin.invalidate_schema_cache()
+        assert get_models(req) is not first
+
+    def test_shared_invalidation(self, req, schema_cache, settings):
+        settings.DATA_BROWSER_SHARED_CACHE_ALIAS = "default"
+        first = get_models(req)
+        fingerprint = orm_admin.get_schema_fingerprint(req)
+        orm_admin.invalidate_schema_cache()
+        orm_admin.invalidate_schema_cache()
+        assert orm_admin.get_schema_fingerprint(req) != fingerprint
+        assert get_models(req) is not first
+
+    def test_fingerprint_inactive_user(self, req, rf):
+        fingerprint = orm_admin.get_schema_fingerprint(req)
+        req.user.is_active = False
+        other = rf.get("/")
+        other.user = req.user
+        assert orm_admin.get_schema_fingerprint(other) != fingerprint
+
+    def test_fingerprint_once_per_request(self, req, settings, mocker):
+        settings.DATA_BROWSER_SHARED_CACHE_ALIAS = "default"
+        get_generation = mocker.spy(orm_admin, "_get_schema_generation")
+        fingerprint = orm_admin.get_schema_fingerprint(req)
+        assert orm_admin.get_schema_fingerprint(req) == fingerprint
+        assert get_generation.call_count == 1
+
+        # public views swap the user part way through the request
+        req.user = User.objects.create(username="owner")
+        orm_admin.get_schema_fingerprint(req)
+        assert get_generation.call_count == 2
+
+
 @pytest.mark.django_db
 @pytest.mark.parametrize(
     "lookup,value",
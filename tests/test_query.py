@@ -5,6 +5,8 @@ from django.http import QueryDict
 from django.utils import timezone
 
 from data_browser import orm_fields
+from data_browser import query as query_module
+from data_browser import types
 from data_browser.orm_admin import OrmModel, get_fields_for_type
 from data_browser.query import BoundQuery, Query, QueryField, QueryFilter
 from data_browser.types import (
@@ -296,6 +298,54 @@ class TestBoundQuery:
         assert [f.path for f in bound_query.filters] == []
 
 
+class TestBindCache:
+    @pytest.fixture(autouse=True)
+    def cache(self, settings):
+        settings.DATA_BROWSER_QUERY_CACHE_SIZE = 10
+        query_module._bind_cache.clear()
+
+    def test_normalized(self):
+        a = Query.from_request(
+            "app.model", "fa+1,fd-0", QueryDict("bob__equals=fred&num__gt=1")
+        )
+        b = Query.from_request(
+            "app.model",
+            "fd-3,&fa+4",
+            QueryDict("num__gt=1&bob__equals=fred&limit=10"),
+        )
+        assert a.normalized == b.normalized
+
+    def test_bind_cached(self, orm_models, mocker):
+        parse = mocker.spy(NumberType, "_parse")
+        a = Query.from_request("app.model", "fa+1,fd-0", QueryDict("num__gt=1"))
+        b = Query.from_request("app.model", "&fd+1,fa", QueryDict("num__gt=1"))
+
+        first = BoundQuery.bind(a, orm_models, "fp")
+        second = BoundQuery.bind(b, orm_models, "fp")
+        assert parse.call_count == 1
+        assert [f.path for f in second.fields] == [["fd"], ["fa"]]
+        assert [f.direction for f in second.fields] == [ASC, None]
+        assert second.fields[0].orm_bound_field is first.fields[1].orm_bound_field
+        assert second.filters == first.filters
+
+        BoundQuery.bind(b, orm_models, "other")
+        assert parse.call_count == 2
+
+    def test_bind_relative_reparsed(self, orm_models):
+        orm_models["app.model"].fields["dt"] = orm_fields.OrmConcreteField(
+            model_name="app.model",
+            name="dt",
+            pretty_name="dt",
+            type_=DateTimeType,
+            rel_name=DateTimeType.name,
+        )
+        query = Query("app.model", [], [QueryFilter("dt", "gt", "now")])
+        first = BoundQuery.bind(query, orm_models, "fp")
+        second = BoundQuery.bind(query, orm_models, "fp")
+        assert second.filters[0] is not first.filters[0]
+        assert second.filters[0].parsed >= first.filters[0].parsed
+
+
 class TestType:
     def test_repr(self):
         assert repr(StringType) == f"StringType"
@@ -407,6 +457,15 @@ class TestDateType:
     def test_format(self):
         assert DateType.format(date(2020, 5, 19)) == "2020-05-19"
 
+    def test_get_formatter(self, mocker):
+        format_ = DateType.get_formatter()
+        dateformat = mocker.spy(types.dateformat, "format")
+        value = DateType.format(date(2020, 5, 19))
+        assert format_(date(2020, 5, 19)) == value
+        assert format_(date(2020, 5, 19)) == value
+        assert format_(None) is None
+        assert dateformat.call_count == 2  # one of them is DateType.format
+
 
 class TestWeekDayType:
     def test_validate(self):
@@ -455,6 +514,10 @@ class TestStringChoiceType:
     def test_format(self):
         assert StringChoiceType.format("b", [("a", "A"), ("b", "B"), ("c", "C")]) == "B"
 
+    def test_get_formatter(self):
+        format_ = StringChoiceType.get_formatter([("a", "A"), ("b", "B")])
+        assert [format_(v) for v in ["b", "a", None]] == ["B", "A", None]
+
 
 class TestNumberChoiceType:
     def test_format(self):